@@ -0,0 +1,74 @@
+'''
+Business: Activity feed - recent events and hourly/daily rollups for the current user
+Args: event with httpMethod, queryStringParameters (limit, hours, days), headers with X-Auth-Token
+Returns: HTTP response with recent activity events and precomputed counters
+'''
+
+from typing import Dict, Any, Optional
+from psycopg2.extras import RealDictCursor
+from db import DatabaseRouter
+from framework import Router, Request, json_response
+from profiling import profiled
+
+database = DatabaseRouter(cursor_factory=RealDictCursor)
+
+def get_db_connection():
+    return database.connect_primary()
+
+def get_user_from_token(request: Request) -> Optional[Dict]:
+    cur = request.read_db.cursor()
+    cur.execute(
+        "SELECT user_id AS id FROM sessions WHERE token = %s AND expires_at > NOW()",
+        (request.token,)
+    )
+    result = cur.fetchone()
+    cur.close()
+    return result
+
+router = Router(connect=get_db_connection, authenticate=get_user_from_token, replicas=database)
+
+@router.route('GET', path='/', auth=True)
+def get_activity(request: Request) -> Dict[str, Any]:
+    user_id = request.user['id']
+    limit = request.int_param('limit', 50, 1, 200)
+    hours = request.int_param('hours', 24, 1, 24 * 7)
+    days = request.int_param('days', 30, 1, 365)
+
+    cur = request.read_db.cursor()
+    cur.execute(
+        '''SELECT id, event_type, source, metadata, created_at
+           FROM activity_events WHERE user_id = %s
+           ORDER BY created_at DESC LIMIT %s''',
+        (user_id, limit)
+    )
+    recent = cur.fetchall()
+
+    cur.execute(
+        '''SELECT event_type, bucket, event_count FROM activity_rollups_hourly
+           WHERE user_id = %s AND bucket >= date_trunc('hour', NOW() AT TIME ZONE 'UTC') - make_interval(hours => %s)
+           ORDER BY bucket''',
+        (user_id, hours)
+    )
+    hourly = cur.fetchall()
+
+    cur.execute(
+        '''SELECT event_type, bucket, event_count FROM activity_rollups_daily
+           WHERE user_id = %s AND bucket >= (NOW() AT TIME ZONE 'UTC')::date - %s
+           ORDER BY bucket''',
+        (user_id, days)
+    )
+    daily = cur.fetchall()
+    cur.close()
+
+    totals: Dict[str, int] = {}
+    for row in daily:
+        totals[row['event_type']] = totals.get(row['event_type'], 0) + row['event_count']
+
+    return json_response(200, {
+        'recent': [dict(r) for r in recent],
+        'hourly': [dict(r) for r in hourly],
+        'daily': [dict(r) for r in daily],
+        'totals': totals
+    })
+
+handler = profiled(router, 'activity')
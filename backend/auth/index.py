@@ -4,18 +4,21 @@ Args: event with httpMethod, body, headers
 Returns: HTTP response with authentication tokens or user data
 '''
 
-import json
-import os
 import hashlib
 import secrets
 from typing import Dict, Any, Optional
-from datetime import datetime, timedelta
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import DatabaseRouter
+from activity import ActivityEmitter
+from framework import Router, Request, Field, json_response, error_response
+from profiling import profiled
+
+database = DatabaseRouter(cursor_factory=RealDictCursor)
 
 def get_db_connection():
-    database_url = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+    return database.connect_primary()
+
+activity = ActivityEmitter('auth', get_db_connection, database.report_primary)
 
 def hash_password(password: str, salt: str = None) -> tuple[str, str]:
     if salt is None:
@@ -30,185 +33,196 @@ def verify_password(password: str, stored_hash: str, salt: str) -> bool:
 def generate_token() -> str:
     return secrets.token_urlsafe(32)
 
-def store_session(user_id: int, token: str):
-    conn = get_db_connection()
-    cur = conn.cursor()
+def store_session(cur, user_id: int, token: str):
     cur.execute(
         "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, NOW() + INTERVAL '30 days')",
         (user_id, token)
     )
+
+def get_user_from_token(request: Request) -> Optional[Dict]:
+    cur = request.read_db.cursor()
+    cur.execute(
+        "SELECT u.id, u.email, u.username FROM users u JOIN sessions s ON u.id = s.user_id WHERE s.token = %s AND s.expires_at > NOW()",
+        (request.token,)
+    )
+    user = cur.fetchone()
+    cur.close()
+    return dict(user) if user else None
+
+EMAIL_PATTERN = r'^[^@\s]+@[^@\s]+$'
+
+REGISTER_SCHEMA = {
+    'email': Field(str, required=True, strip=True, min_length=1, max_length=255, pattern=EMAIL_PATTERN),
+    'password': Field(str, required=True, min_length=1, max_length=128),
+    'username': Field(str, strip=True, max_length=100),
+}
+
+LOGIN_SCHEMA = {
+    'email': Field(str, required=True, strip=True, min_length=1, max_length=255),
+    'password': Field(str, required=True, min_length=1, max_length=128),
+}
+
+router = Router(
+    connect=get_db_connection,
+    replicas=database,
+    authenticate=get_user_from_token,
+    missing_token_error='No token provided',
+    after_request=[activity.after_request]
+)
+
+@router.route('POST', action='register', schema=REGISTER_SCHEMA, max_body=4096)
+def register(request: Request) -> Dict[str, Any]:
+    email = request.data['email']
+    password = request.data['password']
+    username = request.data.get('username') or email.split('@')[0]
+
+    conn = request.db
+    cur = conn.cursor()
+
+    cur.execute("SELECT id FROM users WHERE email = %s", (email,))
+    if cur.fetchone():
+        cur.close()
+        return error_response(400, 'User already exists')
+
+    pwd_hash, salt = hash_password(password)
+    cur.execute(
+        "INSERT INTO users (email, password_hash, username) VALUES (%s, %s, %s) RETURNING id, email, username, created_at",
+        (email, f"{pwd_hash}:{salt}", username)
+    )
+    user = cur.fetchone()
+
+    token = generate_token()
+    store_session(cur, user['id'], token)
     conn.commit()
     cur.close()
-    conn.close()
 
-def get_user_from_token(token: str) -> Optional[Dict]:
-    conn = get_db_connection()
+    activity.emit(user['id'], 'user.registered')
+
+    return json_response(201, {'user': dict(user), 'token': token})
+
+@router.route('POST', action='login', schema=LOGIN_SCHEMA, max_body=4096)
+@router.route('POST', path='/', schema=LOGIN_SCHEMA, max_body=4096)
+def login(request: Request) -> Dict[str, Any]:
+    email = request.data['email']
+    password = request.data['password']
+
+    conn = request.db
     cur = conn.cursor()
     cur.execute(
-        "SELECT u.id, u.email, u.username FROM users u JOIN sessions s ON u.id = s.user_id WHERE s.token = %s AND s.expires_at > NOW()",
-        (token,)
+        "SELECT id, email, username, password_hash, created_at FROM users WHERE email = %s",
+        (email,)
     )
     user = cur.fetchone()
+
+    if not user:
+        cur.close()
+        return error_response(401, 'Invalid credentials')
+
+    stored_hash, salt = user['password_hash'].split(':')
+
+    if not verify_password(password, stored_hash, salt):
+        cur.close()
+        activity.emit(user['id'], 'user.login_failed')
+        return error_response(401, 'Invalid credentials')
+
+    token = generate_token()
+    store_session(cur, user['id'], token)
+    conn.commit()
     cur.close()
-    conn.close()
-    return dict(user) if user else None
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    path = event.get('queryStringParameters', {}).get('action', 'login')
-    
-    if method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        
-        if path == 'register':
-            email = body_data.get('email')
-            password = body_data.get('password')
-            username = body_data.get('username', email.split('@')[0])
-            
-            if not email or not password:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Email and password are required'})
-                }
-            
-            pwd_hash, salt = hash_password(password)
-            password_with_salt = f"{pwd_hash}:{salt}"
-            
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            cur.execute("SELECT id FROM users WHERE email = %s", (email,))
-            existing_user = cur.fetchone()
-            
-            if existing_user:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'User already exists'})
-                }
-            
-            cur.execute(
-                "INSERT INTO users (email, password_hash, username) VALUES (%s, %s, %s) RETURNING id, email, username, created_at",
-                (email, password_with_salt, username)
-            )
-            user = cur.fetchone()
-            conn.commit()
-            
-            token = generate_token()
-            store_session(user['id'], token)
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'user': dict(user),
-                    'token': token
-                }, default=str)
-            }
-        
-        elif path == 'login':
-            email = body_data.get('email')
-            password = body_data.get('password')
-            
-            if not email or not password:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Email and password are required'})
-                }
-            
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            cur.execute(
-                "SELECT id, email, username, password_hash, created_at FROM users WHERE email = %s",
-                (email,)
-            )
-            user = cur.fetchone()
-            
-            cur.close()
-            conn.close()
-            
-            if not user:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Invalid credentials'})
-                }
-            
-            stored_hash, salt = user['password_hash'].split(':')
-            
-            if not verify_password(password, stored_hash, salt):
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Invalid credentials'})
-                }
-            
-            token = generate_token()
-            store_session(user['id'], token)
-            
-            user_data = {
-                'id': user['id'],
-                'email': user['email'],
-                'username': user['username'],
-                'created_at': user['created_at']
-            }
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'user': user_data,
-                    'token': token
-                }, default=str)
-            }
-    
-    if method == 'GET':
-        token = event.get('headers', {}).get('x-auth-token')
-        
-        if not token:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'No token provided'})
-            }
-        
-        user = get_user_from_token(token)
-        if not user:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Invalid or expired token'})
-            }
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'authenticated': True, 'user': user})
-        }
-    
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
+    activity.emit(user['id'], 'user.login')
+
+    return json_response(200, {
+        'user': {
+            'id': user['id'],
+            'email': user['email'],
+            'username': user['username'],
+            'created_at': user['created_at']
+        },
+        'token': token
+    })
+
+@router.route('GET', path='/', auth=True)
+def verify(request: Request) -> Dict[str, Any]:
+    return json_response(200, {'authenticated': True, 'user': request.user})
+
+BOOTSTRAP_FILES_LIMIT = 50
+
+# str(datetime) as the files list encodes it ('2024-01-31 12:00:00[.ffffff]'); json_agg
+# alone would give ISO 8601 with a 'T' and trimmed fractional zeros
+FILE_CREATED_AT_SQL = '''to_char(created_at, 'YYYY-MM-DD HH24:MI:SS')
+    || CASE WHEN date_trunc('second', created_at) = created_at THEN '' ELSE to_char(created_at, '.US') END'''
+
+# One round trip for first paint: the session check, profile, user data, first page of
+# files, storage usage and unread inbox count all come from a single statement.
+BOOTSTRAP_SQL = f'''
+    SELECT u.id, u.email, u.username, u.created_at,
+           u.display_name, u.avatar_url, u.wallpaper_url, u.theme,
+           ud.platforms, ud.games,
+           COALESCE((
+               SELECT json_agg(json_build_object(
+                   'id', id, 'filename', filename, 'original_filename', original_filename,
+                   'file_type', file_type, 'file_size', file_size, 'file_url', CONCAT('/files/', id),
+                   'mime_type', mime_type, 'created_at', {FILE_CREATED_AT_SQL}
+               ) ORDER BY created_at DESC)
+               FROM (
+                   SELECT id, filename, original_filename, file_type, file_size, mime_type, created_at
+                   FROM files WHERE user_id = u.id
+                   ORDER BY created_at DESC LIMIT %s
+               ) f
+           ), '[]'::json) AS files,
+           (SELECT COUNT(*) FROM files WHERE user_id = u.id) AS file_count,
+           (SELECT COALESCE(SUM(file_size), 0)::bigint FROM files WHERE user_id = u.id) AS storage_used,
+           (SELECT COUNT(*) FROM contact_messages WHERE is_read = FALSE) AS unread_messages
+    FROM sessions s
+    JOIN users u ON u.id = s.user_id
+    LEFT JOIN user_data ud ON ud.user_id = u.id
+    WHERE s.token = %s AND s.expires_at > NOW()
+'''
+
+@router.route('GET', action='bootstrap')
+def bootstrap(request: Request) -> Dict[str, Any]:
+    if not request.token:
+        return error_response(401, router.missing_token_error)
+
+    limit = request.int_param('limit', BOOTSTRAP_FILES_LIMIT, 1, 200)
+    # Always the primary: the page seeds its state from this and saves that state back
+    # wholesale, so a lagging replica here would overwrite newer data with older
+    request.use_primary_for_reads()
+    cur = request.read_db.cursor()
+    cur.execute(BOOTSTRAP_SQL, (limit, request.token))
+    row = cur.fetchone()
+    cur.close()
+
+    if not row:
+        return error_response(401, router.invalid_token_error)
+
+    return json_response(200, {
+        'authenticated': True,
+        'user': {
+            'id': row['id'],
+            'email': row['email'],
+            'username': row['username'],
+            'created_at': row['created_at']
+        },
+        'profile': {
+            'id': row['id'],
+            'email': row['email'],
+            'displayName': row['display_name'],
+            'avatarUrl': row['avatar_url'],
+            'wallpaperUrl': row['wallpaper_url'],
+            'theme': row['theme'] or 'system'
+        },
+        'userData': {
+            'platforms': row['platforms'] or [],
+            'games': row['games'] or []
+        },
+        'files': row['files'],
+        'storage': {
+            'fileCount': row['file_count'],
+            'usedBytes': row['storage_used']
+        },
+        'unreadMessages': row['unread_messages']
+    })
+
+handler = profiled(router, 'auth')
@@ -4,245 +4,167 @@ Args: event with httpMethod, body, headers with X-Auth-Token for management
 Returns: HTTP response with message data or operation results
 '''
 
-import json
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from typing import Dict, Any
-from datetime import datetime
-import psycopg2
+from typing import Dict, Any, Optional
 from psycopg2.extras import RealDictCursor
+from db import DatabaseRouter
+from spam_filter import ContactFilter, PostgresBucketStore, client_ip
+from activity import ActivityEmitter
+from framework import Router, Request, Field, json_response, error_response
+from profiling import profiled
+
+database = DatabaseRouter(cursor_factory=RealDictCursor)
 
 def get_db_connection():
-    database_url = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+    return database.connect_primary()
 
-def get_user_id_from_token(token: str) -> int:
-    conn = get_db_connection()
-    cur = conn.cursor()
+activity = ActivityEmitter('contact', get_db_connection, database.report_primary)
+
+contact_filter = ContactFilter(
+    PostgresBucketStore(get_db_connection, database.report_primary)
+    if os.environ.get('CONTACT_RATE_LIMIT_STORE') == 'postgres' else None
+)
+
+def rejected_response(result) -> Dict[str, Any]:
+    headers = {'Retry-After': str(result.retry_after)} if result.retry_after else None
+    return error_response(result.status_code, result.error, headers)
+
+def get_user_from_token(request: Request) -> Optional[Dict]:
+    cur = request.read_db.cursor()
     cur.execute(
-        "SELECT user_id FROM sessions WHERE token = %s AND expires_at > NOW()",
-        (token,)
+        "SELECT user_id AS id FROM sessions WHERE token = %s AND expires_at > NOW()",
+        (request.token,)
     )
     result = cur.fetchone()
     cur.close()
-    conn.close()
-    return result['user_id'] if result else None
-
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'POST')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    headers = event.get('headers', {})
-    token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
-    path = event.get('path', '')
-    
-    if method == 'GET':
-        if not token:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Authentication required'})
-            }
-        
-        user_id = get_user_id_from_token(token)
-        if not user_id:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Invalid token'})
-            }
-        
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
-            SELECT id, name, email, subject, message, created_at, is_read, replied_at
-            FROM contact_messages
-            ORDER BY created_at DESC
-        ''')
-        messages = cur.fetchall()
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps([dict(m) for m in messages], default=str)
-        }
-    
-    if method == 'POST' and not path.endswith('/reply'):
-        try:
-            body = json.loads(event.get('body', '{}'))
-            name = body.get('name', '').strip()
-            email = body.get('email', '').strip()
-            subject = body.get('subject', 'Новое сообщение').strip()
-            message = body.get('message', '').strip()
-            
-            if not name or not email or not message:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Name, email and message are required'})
-                }
-            
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            cur.execute(
-                '''INSERT INTO contact_messages 
-                   (name, email, subject, message, created_at) 
-                   VALUES (%s, %s, %s, %s, NOW()) 
-                   RETURNING id''',
-                (name, email, subject, message)
-            )
-            message_id = cur.fetchone()['id']
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'success': True,
-                    'message': 'Message received successfully',
-                    'id': message_id
-                })
-            }
-            
-        except json.JSONDecodeError:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Invalid JSON'})
-            }
-        except Exception as e:
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': str(e)})
-            }
-    
-    if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Authentication required'})
-        }
-    
-    user_id = get_user_id_from_token(token)
-    if not user_id:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Invalid token'})
-        }
-    
-    conn = get_db_connection()
+    return result
+
+SUBMIT_SCHEMA = {
+    'name': Field(str, required=True, strip=True, min_length=1, max_length=255),
+    'email': Field(str, required=True, strip=True, min_length=1, max_length=255),
+    'subject': Field(str, default='Новое сообщение', strip=True, max_length=500),
+    'message': Field(str, required=True, strip=True, min_length=1, max_length=5000),
+    'website': Field(str, default='', max_length=255),
+}
+
+REPLY_SCHEMA = {
+    'reply': Field(str, required=True, strip=True, min_length=1, max_length=10000),
+}
+
+router = Router(
+    connect=get_db_connection,
+    replicas=database,
+    authenticate=get_user_from_token,
+    invalid_token_error='Invalid token',
+    after_request=[activity.after_request]
+)
+
+@router.route('GET', path='/', auth=True)
+def list_messages(request: Request) -> Dict[str, Any]:
+    cur = request.read_db.cursor()
+    cur.execute('''
+        SELECT id, name, email, subject, message, created_at, is_read, replied_at
+        FROM contact_messages
+        ORDER BY created_at DESC
+    ''')
+    messages = cur.fetchall()
+    cur.close()
+    return json_response(200, [dict(m) for m in messages])
+
+@router.route('POST', path='/', schema=SUBMIT_SCHEMA, max_body=16 * 1024)
+def submit_message(request: Request) -> Dict[str, Any]:
+    data = request.data
+    name = data['name']
+    email = data['email']
+    subject = data['subject']
+    message = data['message']
+
+    verdict = contact_filter.check_submission(
+        client_ip(request.event), name, email, subject, message, data['website'],
+        connect=lambda: request.db
+    )
+    if not verdict.allowed:
+        return rejected_response(verdict)
+    if verdict.duplicate_of is not None:
+        return json_response(200, {
+            'success': True,
+            'message': 'Message received successfully',
+            'id': verdict.duplicate_of
+        })
+
+    conn = request.db
+    cur = conn.cursor()
+    cur.execute(
+        '''INSERT INTO contact_messages
+           (name, email, subject, message, created_at)
+           VALUES (%s, %s, %s, %s, NOW())
+           RETURNING id''',
+        (name, email, subject, message)
+    )
+    message_id = cur.fetchone()['id']
+    conn.commit()
+    cur.close()
+    contact_filter.remember(email, message, message_id)
+
+    activity.emit(None, 'message.received', {'message_id': message_id})
+
+    return json_response(200, {
+        'success': True,
+        'message': 'Message received successfully',
+        'id': message_id
+    })
+
+@router.route('PUT', path='/{message_id}/read', auth=True)
+def mark_read(request: Request) -> Dict[str, Any]:
+    message_id = request.path_params['message_id']
+    conn = request.db
     cur = conn.cursor()
-    
-    try:
-        path_parts = [p for p in path.split('/') if p and p != 'read' and p != 'reply']
-        message_id = path_parts[-1] if path_parts else None
-        
-        if path.endswith('/read') and method == 'PUT':
-            cur.execute(
-                'UPDATE contact_messages SET is_read = TRUE WHERE id = %s',
-                (message_id,)
-            )
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True})
-            }
-        
-        elif path.endswith('/reply') and method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            reply_text = body.get('reply', '').strip()
-            
-            if not reply_text:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Reply text is required'})
-                }
-            
-            cur.execute(
-                'SELECT name, email, subject FROM contact_messages WHERE id = %s',
-                (message_id,)
-            )
-            message = cur.fetchone()
-            
-            if not message:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Message not found'})
-                }
-            
-            cur.execute(
-                'UPDATE contact_messages SET replied_at = NOW() WHERE id = %s',
-                (message_id,)
-            )
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True})
-            }
-        
-        elif method == 'DELETE':
-            cur.execute('DELETE FROM contact_messages WHERE id = %s', (message_id,))
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True})
-            }
-        
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Not found'})
-        }
-        
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)})
-        }
-    finally:
+    cur.execute(
+        'UPDATE contact_messages SET is_read = TRUE WHERE id = %s',
+        (message_id,)
+    )
+    conn.commit()
+    cur.close()
+
+    activity.emit(request.user['id'], 'message.read', {'message_id': message_id})
+
+    return json_response(200, {'success': True})
+
+@router.route('POST', path='/{message_id}/reply', auth=True, schema=REPLY_SCHEMA, max_body=32 * 1024)
+def reply(request: Request) -> Dict[str, Any]:
+    message_id = request.path_params['message_id']
+
+    conn = request.db
+    cur = conn.cursor()
+    cur.execute(
+        'UPDATE contact_messages SET replied_at = NOW() WHERE id = %s RETURNING name, email, subject',
+        (message_id,)
+    )
+    message = cur.fetchone()
+
+    if not message:
+        conn.rollback()
         cur.close()
-        conn.close()
+        return error_response(404, 'Message not found')
+
+    conn.commit()
+    cur.close()
+
+    activity.emit(request.user['id'], 'message.replied', {'message_id': message_id})
+
+    return json_response(200, {'success': True})
+
+@router.route('DELETE', path='/{message_id}', auth=True)
+def delete_message(request: Request) -> Dict[str, Any]:
+    message_id = request.path_params['message_id']
+    conn = request.db
+    cur = conn.cursor()
+    cur.execute('DELETE FROM contact_messages WHERE id = %s', (message_id,))
+    conn.commit()
+    cur.close()
+
+    activity.emit(request.user['id'], 'message.deleted', {'message_id': message_id})
+
+    return json_response(200, {'success': True})
+
+handler = profiled(router, 'contact')
@@ -0,0 +1,261 @@
+'''
+Business: Cheap in-process abuse filtering for public contact submissions
+Args: submission fields plus client IP, optional DB connection factory for shared buckets
+Returns: FilterResult telling the handler whether to accept or reject before any DB write
+'''
+
+import hashlib
+import os
+import random
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+IP_BUCKET_CAPACITY = float(os.environ.get('CONTACT_IP_BURST', '5'))
+IP_REFILL_PER_SEC = float(os.environ.get('CONTACT_IP_PER_HOUR', '20')) / 3600
+EMAIL_BUCKET_CAPACITY = float(os.environ.get('CONTACT_EMAIL_BURST', '3'))
+EMAIL_REFILL_PER_SEC = float(os.environ.get('CONTACT_EMAIL_PER_HOUR', '10')) / 3600
+DUPLICATE_WINDOW_SEC = int(os.environ.get('CONTACT_DUPLICATE_WINDOW', '600'))
+SPAM_SCORE_THRESHOLD = int(os.environ.get('CONTACT_SPAM_THRESHOLD', '5'))
+# Comma-separated client IPs that skip the rate limits, e.g. the deployment test runner
+EXEMPT_IPS = frozenset(ip.strip() for ip in os.environ.get('CONTACT_EXEMPT_IPS', '').split(',') if ip.strip())
+
+# A bucket untouched for this long has refilled completely, so its row can be dropped
+BUCKET_EXPIRY_SEC = int(max(IP_BUCKET_CAPACITY / IP_REFILL_PER_SEC, EMAIL_BUCKET_CAPACITY / EMAIL_REFILL_PER_SEC)) + 1
+BUCKET_CLEANUP_RATE = 0.01
+
+MAX_TRACKED_KEYS = 10000
+
+URL_RE = re.compile(r'https?://|www\.', re.IGNORECASE)
+REPEAT_RE = re.compile(r'(.)\1{9,}')
+WHITESPACE_RE = re.compile(r'\s+')
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+SPAM_WORDS = frozenset([
+    'viagra', 'casino', 'crypto', 'bitcoin', 'forex', 'loan', 'seo',
+    'казино', 'ставки', 'кредит', 'заработок', 'продвижение',
+])
+DISPOSABLE_DOMAINS = frozenset([
+    'mailinator.com', '10minutemail.com', 'guerrillamail.com', 'tempmail.com',
+    'yopmail.com', 'trashmail.com', 'sharklasers.com',
+])
+
+
+@dataclass
+class FilterResult:
+    allowed: bool
+    status_code: int = 200
+    error: str = ''
+    retry_after: int = 0
+    duplicate_of: Optional[int] = None
+
+
+class MemoryBucketStore:
+    '''Token buckets kept in the warm function instance, LRU-bounded'''
+
+    def __init__(self, max_keys: int = MAX_TRACKED_KEYS):
+        self.max_keys = max_keys
+        self.buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+
+    def take(self, key: str, capacity: float, refill_per_sec: float, now: float) -> Tuple[bool, int]:
+        tokens, updated_at = self.buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_per_sec)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        retry_after = 0 if allowed else int((1 - tokens) / refill_per_sec) + 1
+        return allowed, retry_after
+
+    def take_many(self, buckets: List[Tuple[str, float, float]], now: float,
+                  connect: Optional[Callable[[], Any]] = None) -> List[Tuple[bool, int]]:
+        return [self.take(key, capacity, refill, now) for key, capacity, refill in buckets]
+
+
+# Tokens in an existing row after refilling up to the capacity (EXCLUDED.tokens + 1)
+REFILLED_SQL = '''LEAST(EXCLUDED.tokens + 1, contact_rate_limits.tokens
+                              + EXTRACT(EPOCH FROM NOW() - contact_rate_limits.updated_at)
+                              * (SELECT refill FROM input WHERE input.bucket_key = EXCLUDED.bucket_key))'''
+
+
+class PostgresBucketStore:
+    '''Token buckets shared across instances. All buckets of a check are taken with one
+    upsert on one connection (the request's own when given); rows idle long enough to have
+    refilled are deleted now and then. Falls back to per-instance buckets if the database
+    is unavailable (fail open). report (db.DatabaseRouter.report_primary) hears how the
+    work went on a connection the store opened itself.'''
+
+    def __init__(self, connect: Callable[[], Any],
+                 report: Optional[Callable[[Optional[Exception]], None]] = None):
+        self.connect = connect
+        self.report = report
+        self.fallback = MemoryBucketStore()
+
+    def take_many(self, buckets: List[Tuple[str, float, float]], now: float,
+                  connect: Optional[Callable[[], Any]] = None) -> List[Tuple[bool, int]]:
+        conn = None
+        try:
+            conn = connect() if connect is not None else self.connect()
+            results = self._take_shared(buckets, conn)
+            if connect is None and self.report is not None:
+                self.report(None)
+            return results
+        except Exception as e:
+            if connect is None and self.report is not None:
+                self.report(e)
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            return self.fallback.take_many(buckets, now)
+        finally:
+            if connect is None and conn is not None:
+                conn.close()
+
+    def _take_shared(self, buckets: List[Tuple[str, float, float]], conn: Any) -> List[Tuple[bool, int]]:
+        cur = conn.cursor()
+        rows = ', '.join(['(%s, %s::real, %s::real)'] * len(buckets))
+        # Same arithmetic as MemoryBucketStore.take: refill, then charge a token only if
+        # one is available, so a rejected request leaves the bucket where refilling put it
+        cur.execute(
+            f'''WITH input (bucket_key, capacity, refill) AS (VALUES {rows})
+                INSERT INTO contact_rate_limits (bucket_key, tokens, updated_at, last_allowed)
+                SELECT bucket_key, capacity - 1, NOW(), TRUE FROM input
+                ON CONFLICT (bucket_key) DO UPDATE SET
+                    tokens = CASE WHEN {REFILLED_SQL} >= 1 THEN {REFILLED_SQL} - 1 ELSE {REFILLED_SQL} END,
+                    last_allowed = {REFILLED_SQL} >= 1,
+                    updated_at = NOW()
+                RETURNING bucket_key, tokens, last_allowed''',
+            [value for bucket in buckets for value in bucket]
+        )
+        taken = {}
+        for row in cur.fetchall():
+            key, tokens, allowed = (row['bucket_key'], row['tokens'], row['last_allowed']) if isinstance(row, dict) else row
+            taken[key] = (float(tokens), allowed)
+        if random.random() < BUCKET_CLEANUP_RATE:
+            cur.execute(
+                "DELETE FROM contact_rate_limits WHERE updated_at < NOW() - make_interval(secs => %s)",
+                (BUCKET_EXPIRY_SEC,)
+            )
+        conn.commit()
+        cur.close()
+
+        results = []
+        for key, _, refill_per_sec in buckets:
+            tokens, allowed = taken[key]
+            if allowed:
+                results.append((True, 0))
+            else:
+                results.append((False, int((1 - tokens) / refill_per_sec) + 1))
+        return results
+
+
+class DuplicateDetector:
+    '''Sliding window of normalized content hashes seen recently'''
+
+    def __init__(self, window_sec: int = DUPLICATE_WINDOW_SEC, max_keys: int = MAX_TRACKED_KEYS):
+        self.window_sec = window_sec
+        self.max_keys = max_keys
+        self.seen: 'OrderedDict[str, Tuple[float, int]]' = OrderedDict()
+
+    @staticmethod
+    def fingerprint(email: str, message: str) -> str:
+        normalized = WHITESPACE_RE.sub(' ', message).strip().lower()
+        return hashlib.sha256(f"{email.lower()}\x00{normalized}".encode('utf-8')).hexdigest()
+
+    def _evict(self, now: float):
+        while self.seen:
+            seen_at = next(iter(self.seen.values()))[0]
+            if now - seen_at < self.window_sec and len(self.seen) <= self.max_keys:
+                break
+            self.seen.popitem(last=False)
+
+    def lookup(self, digest: str, now: float) -> Optional[int]:
+        '''Id of the message stored for this fingerprint within the window, if any'''
+        self._evict(now)
+        entry = self.seen.get(digest)
+        return entry[1] if entry else None
+
+    def remember(self, digest: str, message_id: int, now: float):
+        self.seen.pop(digest, None)
+        self.seen[digest] = (now, message_id)
+        self._evict(now)
+
+
+def spam_score(name: str, email: str, subject: str, message: str, honeypot: str = '') -> int:
+    if honeypot:
+        return SPAM_SCORE_THRESHOLD
+    score = 0
+    if not EMAIL_RE.match(email):
+        score += 3
+    elif email.rsplit('@', 1)[1].lower() in DISPOSABLE_DOMAINS:
+        score += 2
+    links = len(URL_RE.findall(message)) + len(URL_RE.findall(subject))
+    score += min(links, 4)
+    if URL_RE.search(name):
+        score += 3
+    if REPEAT_RE.search(message):
+        score += 2
+    letters = [c for c in message if c.isalpha()]
+    if len(letters) > 20 and sum(1 for c in letters if c.isupper()) / len(letters) > 0.7:
+        score += 2
+    words = set(WHITESPACE_RE.split(f"{subject} {message}".lower()))
+    score += 2 * len(words & SPAM_WORDS)
+    if len(message) < 3:
+        score += 2
+    return score
+
+
+def client_ip(event: Dict[str, Any]) -> str:
+    '''Address the platform saw the request come from; '' when unknown. Without sourceIp,
+    only the right-most X-Forwarded-For hop is used: it was appended by the proxy in
+    front of the function, while every entry left of it is whatever the client sent.'''
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    if identity.get('sourceIp'):
+        return identity['sourceIp']
+    headers = event.get('headers') or {}
+    forwarded = headers.get('X-Forwarded-For') or headers.get('x-forwarded-for') or ''
+    return forwarded.split(',')[-1].strip()
+
+
+class ContactFilter:
+    def __init__(self, store=None):
+        self.store = store or MemoryBucketStore()
+        self.duplicates = DuplicateDetector()
+
+    def check_submission(self, ip: str, name: str, email: str, subject: str, message: str,
+                         honeypot: str = '', now: Optional[float] = None,
+                         connect: Optional[Callable[[], Any]] = None) -> FilterResult:
+        '''Cheapest checks first: spam and duplicates never touch the database. A duplicate
+        within the window is reported via duplicate_of so the caller can acknowledge it
+        without storing it again. connect, when given, supplies the request's own connection
+        so the shared buckets cost no extra connection.'''
+        now = time.time() if now is None else now
+
+        if spam_score(name, email, subject, message, honeypot) >= SPAM_SCORE_THRESHOLD:
+            return FilterResult(False, 400, 'Message rejected')
+
+        duplicate_of = self.duplicates.lookup(DuplicateDetector.fingerprint(email, message), now)
+        if duplicate_of is not None:
+            return FilterResult(True, duplicate_of=duplicate_of)
+
+        if ip in EXEMPT_IPS:
+            return FilterResult(True)
+
+        # Without a trustworthy address the email bucket alone limits the sender
+        buckets = [(f"email:{email.lower()}", EMAIL_BUCKET_CAPACITY, EMAIL_REFILL_PER_SEC)]
+        if ip:
+            buckets.insert(0, (f"ip:{ip}", IP_BUCKET_CAPACITY, IP_REFILL_PER_SEC))
+        results = self.store.take_many(buckets, now, connect)
+        retry_after = max((retry for allowed, retry in results if not allowed), default=0)
+        if retry_after:
+            return FilterResult(False, 429, 'Too many messages, try again later', retry_after)
+        return FilterResult(True)
+
+    def remember(self, email: str, message: str, message_id: int, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        self.duplicates.remember(DuplicateDetector.fingerprint(email, message), message_id, now)
@@ -0,0 +1,112 @@
+'''
+Business: Build ZIP exports of stored files one entry at a time
+Args: iterable of file rows (id, original_filename, mime_type, file_url, created_at)
+Returns: base64 text of the archive, ready to be used as a cloud function response body
+
+Memory grows with the archive. Rows are decoded one at a time, but the base64
+text of the whole archive is kept until it is returned, and joining the chunks
+copies it once more: peak usage is about 2.7x the archive size plus the largest
+file. Callers must cap the archive size (see FILES_MAX_EXPORT_BYTES in index.py).
+'''
+
+import base64
+import re
+import zipfile
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+# Formats that are already compressed; deflating them again costs CPU for no gain
+STORED_MIME_PREFIXES = ('image/', 'video/', 'audio/')
+STORED_MIME_TYPES = frozenset([
+    'application/zip', 'application/gzip', 'application/x-gzip', 'application/x-7z-compressed',
+    'application/x-rar-compressed', 'application/vnd.rar', 'application/pdf',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+])
+COMPRESSIBLE_IMAGE_TYPES = frozenset(['image/svg+xml', 'image/bmp'])
+
+UNSAFE_NAME_RE = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+class Base64Sink:
+    '''Write-only file object for zipfile: encodes output as it arrives, keeping at most
+    two raw bytes back so each chunk is encoded on a 3-byte boundary'''
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.pending = b''
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        written = len(data)
+        self.size += written
+        data = self.pending + bytes(data)
+        cut = len(data) - len(data) % 3
+        if cut:
+            self.chunks.append(base64.b64encode(data[:cut]).decode('ascii'))
+        self.pending = data[cut:]
+        return written
+
+    def flush(self):
+        pass
+
+    def getvalue(self) -> str:
+        if self.pending:
+            self.chunks.append(base64.b64encode(self.pending).decode('ascii'))
+            self.pending = b''
+        return ''.join(self.chunks)
+
+
+def compression_for(mime_type: Optional[str]) -> int:
+    mime_type = (mime_type or '').lower()
+    if mime_type in COMPRESSIBLE_IMAGE_TYPES:
+        return zipfile.ZIP_DEFLATED
+    if mime_type in STORED_MIME_TYPES or mime_type.startswith(STORED_MIME_PREFIXES):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def entry_name(row: Dict[str, Any], used: Set[str]) -> str:
+    name = UNSAFE_NAME_RE.sub('_', row.get('original_filename') or '').strip(' .') or f"file-{row['id']}"
+    if name in used:
+        stem, dot, ext = name.rpartition('.')
+        if not stem:
+            stem, dot, ext = name, '', ''
+        name = f"{stem} ({row['id']}){dot}{ext}"
+    used.add(name)
+    return name
+
+
+def decode_data_url(file_url: Optional[str]) -> Optional[bytes]:
+    if not file_url or not file_url.startswith('data:'):
+        return None
+    header, _, payload = file_url.partition(',')
+    if ';base64' not in header:
+        return None
+    return base64.b64decode(payload)
+
+
+def zip_timestamp(created_at: Any) -> tuple:
+    if isinstance(created_at, datetime) and created_at.year >= 1980:
+        return created_at.timetuple()[:6]
+    return ZIP_EPOCH
+
+
+def build_zip(rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    '''Returns {'body': base64 archive, 'size': archive bytes, 'entries': count}'''
+    sink = Base64Sink()
+    used: Set[str] = set()
+    entries = 0
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        for row in rows:
+            content = decode_data_url(row['file_url'])
+            if content is None:
+                continue
+            info = zipfile.ZipInfo(entry_name(row, used), zip_timestamp(row.get('created_at')))
+            info.compress_type = compression_for(row.get('mime_type'))
+            archive.writestr(info, content)
+            entries += 1
+            del content
+    return {'body': sink.getvalue(), 'size': sink.size, 'entries': entries}
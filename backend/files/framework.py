@@ -0,0 +1,521 @@
+'''
+Business: Shared request handling for backend functions - routing, CORS, auth, JSON responses
+Args: Router is configured once at import; its __call__ is the cloud function handler
+Returns: HTTP response dicts in the cloud function format
+
+This file is copied verbatim into every function directory because each
+function is deployed as a standalone bundle; keep the copies identical
+with scripts/sync_shared.py.
+'''
+
+import json
+import os
+import re
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+TOKEN_HEADERS = ('X-Auth-Token', 'x-auth-token', 'X-Session-Token', 'x-session-token')
+# WAL position of the client's latest write, sent back so reads wait for it (see db.DatabaseRouter)
+LAST_WRITE_HEADERS = ('X-Last-Write', 'x-last-write')
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+PARAM_RE = re.compile(r'^\{(\w+)\}$')
+
+# json.dumps(..., default=str) builds a new encoder on every call; reuse one instead
+ENCODER = json.JSONEncoder(default=str)
+
+DEFAULT_MAX_BODY = int(os.environ.get('MAX_BODY_BYTES', str(64 * 1024)))
+MISSING = object()
+TYPE_NAMES = {str: 'string', int: 'integer', bool: 'boolean', list: 'array', dict: 'object'}
+
+
+def type_name(expected: Any) -> str:
+    if isinstance(expected, tuple):
+        return ' or '.join(type_name(t) for t in expected)
+    return TYPE_NAMES.get(expected, expected.__name__)
+
+
+class HttpError(Exception):
+    def __init__(self, status_code: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.headers = headers
+
+
+def json_response(status_code: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return {
+        'statusCode': status_code,
+        'headers': {**JSON_HEADERS, **headers} if headers else JSON_HEADERS,
+        'isBase64Encoded': False,
+        'body': ENCODER.encode(payload)
+    }
+
+
+def error_response(status_code: int, message: str, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return json_response(status_code, {'error': message}, headers)
+
+
+class Field:
+    '''Declarative constraints for one body field; compiled into a single check function'''
+
+    def __init__(self, type_: Any, required: bool = False, default: Any = MISSING, nullable: bool = False,
+                 strip: bool = False, min_length: int = 0, max_length: Optional[int] = None,
+                 max_items: Optional[int] = None, items: Any = None,
+                 choices: Optional[Tuple[Any, ...]] = None, pattern: Optional[str] = None):
+        self.type = type_
+        self.required = required
+        self.default = default
+        self.nullable = nullable
+        self.strip = strip
+        self.min_length = min_length
+        self.max_length = max_length
+        self.max_items = max_items
+        self.items = items
+        self.choices = frozenset(choices) if choices else None
+        self.pattern = re.compile(pattern) if pattern else None
+
+    def compile(self, name: str) -> Callable[[Any], Any]:
+        checks: List[Callable[[Any], Any]] = []
+        expected = self.type
+        type_error = f"Field '{name}' must be {type_name(expected)}"
+
+        if expected is int:
+            def check_type(value):
+                if type(value) is not int:
+                    raise HttpError(400, type_error)
+                return value
+        else:
+            def check_type(value):
+                if not isinstance(value, expected):
+                    raise HttpError(400, type_error)
+                return value
+        checks.append(check_type)
+
+        if self.strip:
+            checks.append(str.strip)
+        if self.min_length:
+            min_length = self.min_length
+            short_error = f"Field '{name}' is required" if min_length == 1 else f"Field '{name}' is too short"
+            def check_min(value):
+                if len(value) < min_length:
+                    raise HttpError(400, short_error)
+                return value
+            checks.append(check_min)
+        if self.max_length is not None or self.max_items is not None:
+            if self.max_length is not None:
+                limit = self.max_length
+                long_error = f"Field '{name}' is too long (max {limit})"
+            else:
+                limit = self.max_items
+                long_error = f"Field '{name}' has too many items (max {limit})"
+            def check_max(value):
+                if len(value) > limit:
+                    raise HttpError(400, long_error)
+                return value
+            checks.append(check_max)
+        if self.items is not None:
+            item_type = self.items
+            item_error = f"Field '{name}' must contain only {type_name(item_type)} items"
+            def check_items(value):
+                for item in value:
+                    if not isinstance(item, item_type):
+                        raise HttpError(400, item_error)
+                return value
+            checks.append(check_items)
+        if self.choices is not None:
+            choices = self.choices
+            choice_error = f"Field '{name}' must be one of: {', '.join(sorted(map(str, choices)))}"
+            def check_choice(value):
+                if value not in choices:
+                    raise HttpError(400, choice_error)
+                return value
+            checks.append(check_choice)
+        if self.pattern is not None:
+            match = self.pattern.match
+            pattern_error = f"Field '{name}' has invalid format"
+            def check_pattern(value):
+                if not match(value):
+                    raise HttpError(400, pattern_error)
+                return value
+            checks.append(check_pattern)
+
+        nullable = self.nullable
+        if len(checks) == 1 and not nullable:
+            return check_type
+
+        def check(value):
+            if value is None and nullable:
+                return None
+            for step in checks:
+                value = step(value)
+            return value
+        return check
+
+
+def compile_schema(fields: Dict[str, Field]) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    '''Builds a validator once at import. The result keeps only declared fields that were
+    sent (plus defaults), so handlers can still tell "absent" from "empty".'''
+    compiled = tuple(
+        (name, field.compile(name), field.required, field.default)
+        for name, field in fields.items()
+    )
+
+    def validate(body: Dict[str, Any]) -> Dict[str, Any]:
+        data: Dict[str, Any] = {}
+        for name, check, required, default in compiled:
+            value = body.get(name, MISSING)
+            if value is MISSING or value is None and required:
+                if required:
+                    raise HttpError(400, f"Field '{name}' is required")
+                if default is not MISSING:
+                    data[name] = default() if callable(default) else default
+                continue
+            data[name] = check(value)
+        return data
+    return validate
+
+
+def get_token(headers: Dict[str, str]) -> Optional[str]:
+    for name in TOKEN_HEADERS:
+        token = headers.get(name)
+        if token:
+            return token
+    return None
+
+
+def with_headers(response: Dict[str, Any], headers: Dict[str, str], expose: str) -> Dict[str, Any]:
+    '''Copy of response with extra headers, readable by browser code through CORS'''
+    merged = dict(response.get('headers') or {})
+    merged.update(headers)
+    exposed = merged.get('Access-Control-Expose-Headers')
+    merged['Access-Control-Expose-Headers'] = f"{exposed}, {expose}" if exposed else expose
+    return {**response, 'headers': merged}
+
+
+class Request:
+    __slots__ = ('event', 'context', 'method', 'path', 'params', 'headers',
+                 'path_params', 'user', 'data', 'max_body', 'on_replica', 'replica', 'wrote',
+                 '_connect', '_connect_read', '_conn', '_read_conn', '_body')
+
+    def __init__(self, event: Dict[str, Any], context: Any, method: str, connect: Optional[Callable[[], Any]],
+                 connect_read: Optional[Callable[[Optional[int], Optional[str]], Tuple[Any, Any]]] = None):
+        self.event = event
+        self.context = context
+        self.method = method
+        self.path: str = event.get('path') or '/'
+        self.params: Dict[str, str] = event.get('queryStringParameters') or {}
+        self.headers: Dict[str, str] = event.get('headers') or {}
+        self.path_params: Dict[str, str] = {}
+        self.user: Optional[Dict[str, Any]] = None
+        self.data: Dict[str, Any] = {}
+        self.max_body = DEFAULT_MAX_BODY
+        self.on_replica = False
+        self.replica: Any = None
+        self.wrote = False
+        self._connect = connect
+        self._connect_read = connect_read
+        self._conn = None
+        self._read_conn = None
+        self._body: Any = None
+
+    @property
+    def token(self) -> Optional[str]:
+        return get_token(self.headers)
+
+    @property
+    def last_write(self) -> Optional[str]:
+        for name in LAST_WRITE_HEADERS:
+            value = self.headers.get(name)
+            if value:
+                return value
+        return None
+
+    def int_param(self, name: str, default: int, minimum: int, maximum: int) -> int:
+        '''Query string integer clamped to [minimum, maximum]; 400 when it is not an integer'''
+        raw = self.params.get(name)
+        if raw is None or raw == '':
+            return default
+        try:
+            value = int(raw)
+        except ValueError:
+            raise HttpError(400, f"Parameter '{name}' must be an integer")
+        return max(minimum, min(value, maximum))
+
+    @property
+    def body(self) -> Dict[str, Any]:
+        if self._body is None:
+            raw = self.event.get('body') or '{}'
+            if len(raw) > self.max_body:
+                raise HttpError(413, f"Request body too large (max {self.max_body} bytes)")
+            try:
+                self._body = json.loads(raw)
+            except (TypeError, ValueError):
+                raise HttpError(400, 'Invalid JSON')
+            if not isinstance(self._body, dict):
+                raise HttpError(400, 'Invalid JSON')
+        return self._body
+
+    @property
+    def db(self):
+        '''Primary connection, opened on first use; anything that writes goes through here'''
+        self.wrote = True
+        return self._primary()
+
+    @property
+    def read_db(self):
+        '''Connection for read-only queries: a replica when one is configured and fresh enough,
+        otherwise the primary connection (shared with db, so a request opens at most one)'''
+        if self._read_conn is not None:
+            return self._read_conn
+        if self._connect_read is None:
+            return self._primary()
+        user_id = self.user['id'] if self.user else None
+        conn, self.replica = self._connect_read(user_id, self.last_write)
+        self.on_replica = self.replica is not None
+        self._connect_read = None
+        if self.on_replica:
+            self._read_conn = conn
+            return conn
+        if self._conn is None:
+            self._conn = conn
+        else:
+            conn.close()
+        return self._conn
+
+    @property
+    def primary_connection(self):
+        '''The primary connection if this request opened one, without opening it'''
+        return self._conn
+
+    def _primary(self):
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def use_primary_for_reads(self):
+        '''Drop the replica, e.g. when a session created moments ago has not replicated yet'''
+        if self._read_conn is not None:
+            try:
+                self._read_conn.close()
+            except Exception:
+                pass
+            self._read_conn = None
+        self._connect_read = None
+        self.on_replica = False
+        self.replica = None
+
+    def close(self):
+        for conn in (self._read_conn, self._conn):
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        self._conn = None
+        self._read_conn = None
+
+
+class Route:
+    __slots__ = ('func', 'auth', 'validate', 'max_body', 'segments', 'params')
+
+    def __init__(self, func: Callable, auth: bool, template: Optional[str] = None,
+                 schema: Optional[Dict[str, Field]] = None, max_body: int = DEFAULT_MAX_BODY):
+        self.func = func
+        self.auth = auth
+        self.validate = compile_schema(schema) if schema is not None else None
+        self.max_body = max_body
+        self.segments: Tuple[Optional[str], ...] = ()
+        self.params: Tuple[Tuple[int, str], ...] = ()
+        if template:
+            parts = template.strip('/').split('/')
+            names = [PARAM_RE.match(part) for part in parts]
+            self.segments = tuple(None if name else part for part, name in zip(parts, names))
+            self.params = tuple((i - len(parts), name.group(1)) for i, name in enumerate(names) if name)
+
+    def match_tail(self, parts: List[str]) -> Optional[Dict[str, str]]:
+        '''Match the template against the trailing path segments (the function URL may add a prefix)'''
+        size = len(self.segments)
+        if len(parts) < size:
+            return None
+        offset = len(parts) - size
+        for i, expected in enumerate(self.segments):
+            if expected is not None and expected != parts[offset + i]:
+                return None
+        return {name: parts[index] for index, name in self.params}
+
+
+class Router:
+    '''Route table keyed by method and ?action= / exact path, with precompiled segment
+    templates for parameterised paths such as /{id}/read. Static routes are a single dict
+    lookup; only the (few) parameterised routes of the request's method are scanned.
+
+    authenticate(request) returns the user dict for request.token or None; it runs only
+    for routes declared with auth=True, on the same connection the endpoint will use.
+
+    replicas (a db.DatabaseRouter) enables read routing: authenticate and read-only endpoints
+    query request.read_db. A session missing on a replica is re-checked on the primary, and
+    any request that used request.db counts as a write for that user: its response carries
+    X-Last-Write, and requests sending that value back read only from replicas that have
+    replayed it. A read-only request whose replica connection breaks mid-query is run once
+    more on the primary, and that replica is put in cooldown. It also bounds database
+    timeouts by the invocation deadline and turns database outages into 503 + Retry-After
+    (see db.DatabaseRouter).
+
+    Routes declared with schema= get their body size-checked, parsed and validated into
+    request.data before authentication, so malformed payloads never reach the database.
+
+    after_request hooks run with the request before its connections are closed.
+    '''
+
+    def __init__(self, connect: Optional[Callable[[], Any]] = None,
+                 authenticate: Optional[Callable[[Request], Optional[Dict[str, Any]]]] = None,
+                 replicas: Any = None,
+                 missing_token_error: str = 'Authentication required',
+                 invalid_token_error: str = 'Invalid or expired token',
+                 after_request: Optional[List[Callable[[Request], None]]] = None):
+        self.connect = connect
+        self.replicas = replicas
+        self.authenticate = authenticate
+        self.missing_token_error = missing_token_error
+        self.invalid_token_error = invalid_token_error
+        self.after_request = after_request or []
+        self.actions: Dict[Tuple[str, str], Route] = {}
+        self.paths: Dict[Tuple[str, str], Route] = {}
+        self.patterns: Dict[str, List[Route]] = {}
+        self.methods = {'OPTIONS'}
+        self._preflight: Optional[Dict[str, Any]] = None
+        self._not_allowed = error_response(405, 'Method not allowed')
+        self._not_found = error_response(404, 'Not found')
+
+    def route(self, method: str, path: Optional[str] = None, action: Optional[str] = None, auth: bool = False,
+              schema: Optional[Dict[str, Field]] = None, max_body: int = DEFAULT_MAX_BODY):
+        def decorator(func: Callable):
+            if action is not None:
+                self.actions[(method, action)] = Route(func, auth, schema=schema, max_body=max_body)
+            elif path and '{' in path:
+                self.patterns.setdefault(method, []).append(Route(func, auth, path, schema, max_body))
+            else:
+                self.paths[(method, (path or '/').rstrip('/') or '/')] = Route(func, auth, schema=schema, max_body=max_body)
+            self.methods.add(method)
+            self._preflight = None
+            return func
+        return decorator
+
+    def preflight(self) -> Dict[str, Any]:
+        if self._preflight is None:
+            self._preflight = {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': ', '.join(sorted(self.methods)),
+                    'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-Session-Token, Idempotency-Key, X-Last-Write, X-Debug-Profile',
+                    'Access-Control-Max-Age': '86400'
+                },
+                'body': ''
+            }
+        return self._preflight
+
+    def match(self, request: Request) -> Optional[Route]:
+        method = request.method
+        if self.actions:
+            action = request.params.get('action')
+            if action is not None:
+                route = self.actions.get((method, action))
+                if route:
+                    return route
+        path = request.path
+        if path != '/':
+            path = path.rstrip('/') or '/'
+        route = self.paths.get((method, path))
+        if route:
+            return route
+        patterns = self.patterns.get(method)
+        if patterns and path != '/':
+            parts = path.strip('/').split('/')
+            for route in patterns:
+                found = route.match_tail(parts)
+                if found is not None:
+                    request.path_params = found
+                    return route
+        return self.paths.get((method, '/'))
+
+    def dispatch(self, route: Route, request: Request) -> Dict[str, Any]:
+        if route.auth:
+            request.user = self.authenticate(request)
+            if not request.user and request.on_replica:
+                request.use_primary_for_reads()
+                request.user = self.authenticate(request)
+            if not request.user:
+                return error_response(401, self.invalid_token_error)
+            if request.on_replica and self.replicas.wrote_recently(request.user['id']):
+                request.use_primary_for_reads()
+        return route.func(request)
+
+    def replica_failed(self, request: Request, error: Exception) -> bool:
+        '''True when error is a broken replica connection in a request that has not written,
+        so the whole request can safely be repeated on the primary'''
+        if not request.on_replica or request.wrote or not self.replicas.is_connection_error(error):
+            return False
+        traceback.print_exc()
+        self.replicas.replica_failed(request.replica)
+        request.use_primary_for_reads()
+        request.user = None
+        return True
+
+    def __call__(self, event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        method = event.get('httpMethod', 'GET')
+        if method == 'OPTIONS':
+            return self.preflight()
+        if self.replicas is not None:
+            self.replicas.start_request(context)
+        # Only GETs are routed to replicas; writes authenticate on the primary they will use anyway
+        request = Request(event, context, method, self.connect,
+                          self.replicas.connect_read if self.replicas is not None and method == 'GET' else None)
+        try:
+            route = self.match(request)
+            if route is None:
+                return self._not_allowed if method not in self.methods else self._not_found
+            request.max_body = route.max_body
+            if route.auth and not request.token:
+                return error_response(401, self.missing_token_error)
+            if route.validate is not None:
+                request.data = route.validate(request.body)
+            try:
+                response = self.dispatch(route, request)
+            except Exception as e:
+                if not self.replica_failed(request, e):
+                    raise
+                response = self.dispatch(route, request)
+            if self.replicas is not None:
+                if request.primary_connection is not None:
+                    self.replicas.observe_success()
+                if request.wrote and request.user:
+                    self.replicas.note_write(request.user['id'])
+                if request.wrote and request.primary_connection is not None:
+                    position = self.replicas.write_position(request.primary_connection)
+                    if position:
+                        response = with_headers(response, {'X-Last-Write': position}, 'X-Last-Write')
+            return response
+        except HttpError as e:
+            # An HttpError raised after using the primary still means the primary answered; 503
+            # is the database layer itself giving up (breaker open, deadline spent)
+            if self.replicas is not None and request.primary_connection is not None and e.status_code != 503:
+                self.replicas.observe_success()
+            return error_response(e.status_code, e.message, e.headers)
+        except Exception as e:
+            traceback.print_exc()
+            unavailable = None
+            if self.replicas is not None:
+                unavailable = self.replicas.observe_error(e, request.primary_connection, request.on_replica)
+            if unavailable is not None:
+                return error_response(unavailable.status_code, unavailable.message, unavailable.headers)
+            return error_response(500, 'Internal server error')
+        finally:
+            for hook in self.after_request:
+                try:
+                    hook(request)
+                except Exception:
+                    traceback.print_exc()
+            request.close()
+            if self.replicas is not None:
+                self.replicas.finish_request()
@@ -4,161 +4,315 @@ Args: event with httpMethod, body, headers with X-Auth-Token
 Returns: HTTP response with file data or operation results
 '''
 
-import json
 import os
 import base64
+import hashlib
+import random
 import uuid
-from typing import Dict, Any
-from datetime import datetime
-import psycopg2
+from typing import Dict, Any, Optional
 from psycopg2.extras import RealDictCursor
+from db import DatabaseRouter
+from activity import ActivityEmitter
+from archive import build_zip
+from framework import Router, Request, Field, HttpError, json_response, error_response
+from profiling import profiled
+
+database = DatabaseRouter(cursor_factory=RealDictCursor)
 
 def get_db_connection():
-    database_url = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+    return database.connect_primary()
 
-def get_user_id_from_token(token: str) -> int:
-    conn = get_db_connection()
-    cur = conn.cursor()
+activity = ActivityEmitter('files', get_db_connection, database.report_primary)
+
+def get_user_from_token(request: Request) -> Optional[Dict]:
+    cur = request.read_db.cursor()
     cur.execute(
-        "SELECT user_id FROM sessions WHERE token = %s AND expires_at > NOW()",
-        (token,)
+        "SELECT user_id AS id FROM sessions WHERE token = %s AND expires_at > NOW()",
+        (request.token,)
     )
     result = cur.fetchone()
     cur.close()
-    conn.close()
-    return result['user_id'] if result else None
-
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    headers = event.get('headers', {})
-    token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
-    
-    if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Authentication required'})
-        }
-    
-    user_id = get_user_id_from_token(token)
-    if not user_id:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Invalid or expired token'})
-        }
-    
-    if method == 'GET':
-        query_params = event.get('queryStringParameters') or {}
-        file_id = query_params.get('id')
-        
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        if file_id:
-            cur.execute(
-                "SELECT id, filename, original_filename, file_type, file_size, file_url, mime_type, created_at FROM files WHERE id = %s AND user_id = %s",
-                (file_id, user_id)
-            )
-            file = cur.fetchone()
-            cur.close()
-            conn.close()
-            
-            if not file:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'File not found'})
-                }
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(dict(file), default=str)
-            }
-        else:
-            limit = int(query_params.get('limit', '50'))
-            offset = int(query_params.get('offset', '0'))
-            
-            cur.execute(
-                '''SELECT id, filename, original_filename, file_type, file_size, 
-                   CONCAT('/files/', id) as file_url, mime_type, created_at 
-                   FROM files WHERE user_id = %s ORDER BY created_at DESC LIMIT %s OFFSET %s''',
-                (user_id, limit, offset)
-            )
-            
-            files = cur.fetchall()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps([dict(f) for f in files], default=str)
-            }
-    
-    if method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        
-        filename = body_data.get('filename')
-        file_content = body_data.get('content')
-        file_type = body_data.get('file_type', 'application/octet-stream')
-        mime_type = body_data.get('mime_type', file_type)
-        
-        if not filename or not file_content:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Filename and content are required'})
-            }
-        
+    return result
+
+MAX_UPLOAD_BODY = int(os.environ.get('FILES_MAX_UPLOAD_BYTES', str(64 * 1024 * 1024)))
+
+UPLOAD_SCHEMA = {
+    'filename': Field(str, required=True, min_length=1, max_length=200),
+    'content': Field(str, required=True, min_length=1),
+    'file_type': Field(str, default='application/octet-stream', max_length=100),
+    'mime_type': Field(str, max_length=100),
+    'content_hash': Field(str, pattern=r'^[0-9a-f]{64}$'),
+}
+
+FILE_COLUMNS = 'id, filename, original_filename, file_type, file_size, file_url, mime_type, created_at'
+IDEMPOTENCY_HEADERS = ('Idempotency-Key', 'idempotency-key')
+IDEMPOTENCY_TTL = "INTERVAL '24 hours'"
+IDEMPOTENCY_CLEANUP_RATE = 0.01
+
+# Each archive is returned as one base64 response body, which must fit the platform's
+# response size limit (3.5 MB); the stored-size cap per page leaves room for base64 and ZIP overhead
+MAX_RESPONSE_BYTES = int(os.environ.get('FILES_MAX_RESPONSE_BYTES', str(3 * 1024 * 1024 + 512 * 1024)))
+MAX_EXPORT_BYTES = int(os.environ.get('FILES_MAX_EXPORT_BYTES', str(2 * 1024 * 1024 + 512 * 1024)))
+MAX_EXPORT_IDS = 1000
+
+router = Router(
+    connect=get_db_connection,
+    replicas=database,
+    authenticate=get_user_from_token,
+    after_request=[activity.after_request]
+)
+
+@router.route('GET', path='/', auth=True)
+def get_files(request: Request) -> Dict[str, Any]:
+    user_id = request.user['id']
+    file_id = request.params.get('id')
+    cur = request.read_db.cursor()
+
+    if file_id:
+        cur.execute(
+            "SELECT id, filename, original_filename, file_type, file_size, file_url, mime_type, created_at FROM files WHERE id = %s AND user_id = %s",
+            (file_id, user_id)
+        )
+        file = cur.fetchone()
+        cur.close()
+
+        if not file:
+            return error_response(404, 'File not found')
+
+        return json_response(200, dict(file))
+
+    limit = request.int_param('limit', 50, 1, 200)
+    offset = request.int_param('offset', 0, 0, 1_000_000)
+
+    cur.execute(
+        '''SELECT id, filename, original_filename, file_type, file_size,
+           CONCAT('/files/', id) as file_url, mime_type, created_at
+           FROM files WHERE user_id = %s ORDER BY created_at DESC LIMIT %s OFFSET %s''',
+        (user_id, limit, offset)
+    )
+    files = cur.fetchall()
+    cur.close()
+
+    return json_response(200, [dict(f) for f in files])
+
+def export_filter(request: Request, user_id: int):
+    '''?ids=1,2,3 or ?ids=all, optionally narrowed by ?file_type=video/mp4 (or a prefix like video)'''
+    conditions = ['user_id = %s']
+    params: list = [user_id]
+
+    ids = (request.params.get('ids') or 'all').strip()
+    if ids != 'all':
         try:
-            file_bytes = base64.b64decode(file_content)
-            file_size = len(file_bytes)
-        except Exception:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Invalid file content'})
-            }
-        
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        file_url = f"data:{mime_type};base64,{file_content}"
-        
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
+            id_list = sorted({int(part) for part in ids.split(',') if part.strip()})
+        except ValueError:
+            raise HttpError(400, 'ids must be a comma-separated list of file ids or "all"')
+        if not id_list:
+            raise HttpError(400, 'ids must be a comma-separated list of file ids or "all"')
+        if len(id_list) > MAX_EXPORT_IDS:
+            raise HttpError(400, f'Too many ids (max {MAX_EXPORT_IDS})')
+        conditions.append('id = ANY(%s)')
+        params.append(id_list)
+
+    file_type = request.params.get('file_type')
+    if file_type:
+        if '/' in file_type:
+            conditions.append('file_type = %s')
+            params.append(file_type)
+        else:
+            conditions.append("split_part(file_type, '/', 1) = %s")
+            params.append(file_type)
+
+    return ' AND '.join(conditions), params
+
+def iter_export_rows(conn, where: str, params: list):
+    # Server-side cursor: rows (each holding a whole file) are pulled one at a time
+    cur = conn.cursor(name='files_export')
+    cur.itersize = 1
+    try:
         cur.execute(
-            "INSERT INTO files (user_id, filename, original_filename, file_type, file_size, file_url, mime_type) VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id, filename, original_filename, file_type, file_size, file_url, mime_type, created_at",
-            (user_id, unique_filename, filename, file_type, file_size, file_url, mime_type)
+            f"SELECT id, original_filename, mime_type, file_url, created_at FROM files WHERE {where} ORDER BY id",
+            params
         )
-        new_file = cur.fetchone()
-        conn.commit()
+        for row in cur:
+            yield row
+    finally:
         cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 201,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps(dict(new_file), default=str)
-        }
-    
+
+def export_page(conn, where: str, params: list, after_id: int, limit: int) -> Optional[Dict[str, Any]]:
+    '''Ids of the next page: up to limit files after after_id whose sizes add up to at most
+    MAX_EXPORT_BYTES. None when nothing is left; 'more' tells whether files remain after it.'''
+    cur = conn.cursor()
+    cur.execute(
+        f'''SELECT id, COALESCE(file_size, 0) AS file_size,
+                   SUM(COALESCE(file_size, 0)) OVER (ORDER BY id) AS running
+            FROM files WHERE {where} AND id > %s ORDER BY id LIMIT %s''',
+        params + [after_id, limit + 1]
+    )
+    rows = cur.fetchall()
+    cur.close()
+    if not rows:
+        return None
+    if rows[0]['file_size'] > MAX_EXPORT_BYTES:
+        raise HttpError(413, f"File {rows[0]['id']} is too large to export (max {MAX_EXPORT_BYTES} bytes)")
+    taken = [row for row in rows[:limit] if row['running'] <= MAX_EXPORT_BYTES]
+    return {'last_id': taken[-1]['id'], 'more': len(taken) < len(rows)}
+
+@router.route('GET', action='export', auth=True)
+def export_files(request: Request) -> Dict[str, Any]:
+    '''One ZIP per call, paged by id: files after ?after_id= (default 0), at most ?limit= of
+    them and MAX_EXPORT_BYTES in total. X-Next-After-Id carries the cursor for the next
+    page and is absent on the last one.'''
+    user_id = request.user['id']
+    where, params = export_filter(request, user_id)
+    after_id = request.int_param('after_id', 0, 0, 2 ** 63 - 1)
+    limit = request.int_param('limit', MAX_EXPORT_IDS, 1, MAX_EXPORT_IDS)
+    conn = request.read_db
+
+    page = export_page(conn, where, params, after_id, limit)
+    if page is None:
+        return error_response(404, 'No files to export')
+
+    archive = build_zip(iter_export_rows(conn, f"{where} AND id > %s AND id <= %s", params + [after_id, page['last_id']]))
+    conn.rollback()
+    if len(archive['body']) > MAX_RESPONSE_BYTES:
+        return error_response(413, 'Export too large for a single response, lower the limit')
+
+    activity.emit(user_id, 'files.exported', {'files': archive['entries'], 'bytes': archive['size']})
+
+    headers = {
+        'Content-Type': 'application/zip',
+        'Content-Disposition': 'attachment; filename="files-export.zip"',
+        'Access-Control-Allow-Origin': '*'
+    }
+    if page['more']:
+        headers['X-Next-After-Id'] = str(page['last_id'])
+        headers['Access-Control-Expose-Headers'] = 'X-Next-After-Id'
     return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
\ No newline at end of file
+        'statusCode': 200,
+        'headers': headers,
+        'isBase64Encoded': True,
+        'body': archive['body']
+    }
+
+def get_idempotency_key(request: Request) -> Optional[str]:
+    for name in IDEMPOTENCY_HEADERS:
+        key = request.headers.get(name)
+        if key:
+            return key[:255]
+    return None
+
+def find_by_key(cur, user_id: int, key: str) -> Optional[Dict]:
+    cur.execute(
+        f'''SELECT f.id, f.filename, f.original_filename, f.file_type, f.file_size, f.file_url, f.mime_type,
+                   f.created_at, f.content_hash
+            FROM upload_idempotency_keys k JOIN files f ON f.id = k.file_id
+            WHERE k.user_id = %s AND k.idempotency_key = %s AND k.created_at > NOW() - {IDEMPOTENCY_TTL}''',
+        (user_id, key)
+    )
+    return cur.fetchone()
+
+def find_by_hash(cur, user_id: int, content_hash: str) -> Optional[Dict]:
+    cur.execute(
+        f"SELECT {FILE_COLUMNS} FROM files WHERE user_id = %s AND content_hash = %s",
+        (user_id, content_hash)
+    )
+    return cur.fetchone()
+
+def remember_key(cur, user_id: int, key: Optional[str], file_id: int):
+    if not key:
+        return
+    cur.execute(
+        '''INSERT INTO upload_idempotency_keys (user_id, idempotency_key, file_id)
+           VALUES (%s, %s, %s) ON CONFLICT (user_id, idempotency_key) DO NOTHING''',
+        (user_id, key, file_id)
+    )
+    if random.random() < IDEMPOTENCY_CLEANUP_RATE:
+        cur.execute(f"DELETE FROM upload_idempotency_keys WHERE created_at < NOW() - {IDEMPOTENCY_TTL}")
+
+def replayed(cur, conn, user_id: int, key: Optional[str], existing: Dict) -> Dict[str, Any]:
+    remember_key(cur, user_id, key, existing['id'])
+    conn.commit()
+    cur.close()
+    existing = dict(existing)
+    existing.pop('content_hash', None)
+    return json_response(200, existing)
+
+def key_reused(cur) -> Dict[str, Any]:
+    cur.close()
+    return error_response(422, 'Idempotency-Key was already used for a different file')
+
+@router.route('POST', path='/', auth=True, schema=UPLOAD_SCHEMA, max_body=MAX_UPLOAD_BODY)
+def upload_file(request: Request) -> Dict[str, Any]:
+    user_id = request.user['id']
+    filename = request.data['filename']
+    file_content = request.data['content']
+    file_type = request.data['file_type']
+    mime_type = request.data.get('mime_type', file_type)
+    client_hash = request.data.get('content_hash')
+    key = get_idempotency_key(request)
+
+    conn = request.db
+    cur = conn.cursor()
+
+    # With a client hash, retries and repeated uploads are answered before the payload is decoded
+    by_key = find_by_key(cur, user_id, key) if key else None
+    if client_hash:
+        if by_key:
+            if by_key['content_hash'] != client_hash:
+                return key_reused(cur)
+            return replayed(cur, conn, user_id, key, by_key)
+        existing = find_by_hash(cur, user_id, client_hash)
+        if existing:
+            return replayed(cur, conn, user_id, key, existing)
+
+    try:
+        file_bytes = base64.b64decode(file_content)
+        file_size = len(file_bytes)
+    except Exception:
+        cur.close()
+        return error_response(400, 'Invalid file content')
+
+    content_hash = hashlib.sha256(file_bytes).hexdigest()
+    if client_hash and client_hash != content_hash:
+        cur.close()
+        return error_response(400, 'content_hash does not match content')
+
+    if by_key:
+        if by_key['content_hash'] != content_hash:
+            return key_reused(cur)
+        return replayed(cur, conn, user_id, key, by_key)
+
+    if not client_hash:
+        existing = find_by_hash(cur, user_id, content_hash)
+        if existing:
+            return replayed(cur, conn, user_id, key, existing)
+
+    unique_filename = f"{uuid.uuid4()}_{filename}"
+    file_url = f"data:{mime_type};base64,{file_content}"
+
+    cur.execute(
+        f'''INSERT INTO files (user_id, filename, original_filename, file_type, file_size, file_url, mime_type, content_hash)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (user_id, content_hash) WHERE content_hash IS NOT NULL DO NOTHING
+            RETURNING {FILE_COLUMNS}''',
+        (user_id, unique_filename, filename, file_type, file_size, file_url, mime_type, content_hash)
+    )
+    new_file = cur.fetchone()
+    if not new_file:
+        # A concurrent request stored the same content first
+        return replayed(cur, conn, user_id, key, find_by_hash(cur, user_id, content_hash))
+
+    remember_key(cur, user_id, key, new_file['id'])
+    conn.commit()
+    cur.close()
+
+    activity.emit(user_id, 'file.uploaded', {
+        'file_id': new_file['id'],
+        'filename': filename,
+        'file_type': file_type,
+        'file_size': file_size
+    })
+
+    return json_response(201, dict(new_file))
+
+handler = profiled(router, 'files')
@@ -0,0 +1,108 @@
+'''
+Business: Buffered activity event emitter shared by all backend functions
+Args: DB connection factory; events are (user_id, event_type, metadata)
+Returns: Nothing - events are appended to activity_events and rolled up hourly/daily in one batch
+
+This file is copied verbatim into every function directory because each
+function is deployed as a standalone bundle; keep the copies identical
+with scripts/sync_shared.py.
+'''
+
+import json
+import os
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from psycopg2.extras import execute_values
+
+MAX_BUFFER = int(os.environ.get('ACTIVITY_MAX_BUFFER', '1000'))
+
+
+class ActivityEmitter:
+    '''Collects a request's events and writes them with multi-row inserts.
+
+    emit() never touches the database and is called after the handler's own commit.
+    after_request() is the Router hook: it writes whatever the request buffered before
+    the response is returned, because an idle serverless instance may be frozen or
+    killed at any point afterwards. It reuses the request's primary connection when
+    the handler opened one. Activity is best effort: a failed flush is dropped, never
+    surfaced to the caller. report (db.DatabaseRouter.report_primary) hears how a flush
+    on a connection of its own went, since no request is there to tell the breaker.
+    '''
+
+    def __init__(self, source: str, connect: Callable[[], Any],
+                 report: Optional[Callable[[Optional[Exception]], None]] = None):
+        self.source = source
+        self.connect = connect
+        self.report = report
+        self.buffer: List[Tuple[Optional[int], str, str, str, datetime]] = []
+
+    def emit(self, user_id: Optional[int], event_type: str, metadata: Optional[Dict[str, Any]] = None):
+        if len(self.buffer) >= MAX_BUFFER:
+            self.buffer.pop(0)
+        self.buffer.append((
+            user_id, event_type, self.source,
+            json.dumps(metadata or {}, default=str), datetime.utcnow()
+        ))
+
+    def after_request(self, request: Any):
+        if self.buffer:
+            # Any primary connection the request holds will do, even one opened for reads;
+            # request.db would open one just for this and mark the request as a write
+            self.flush(request.primary_connection)
+
+    def flush(self, conn: Any = None):
+        if not self.buffer:
+            return
+        events, self.buffer = self.buffer, []
+
+        hourly: Counter = Counter()
+        daily: Counter = Counter()
+        for user_id, event_type, _, _, created_at in events:
+            hourly[(user_id, event_type, created_at.replace(minute=0, second=0, microsecond=0))] += 1
+            daily[(user_id, event_type, created_at.date())] += 1
+
+        own = conn is None
+        try:
+            if own:
+                conn = self.connect()
+            cur = conn.cursor()
+            execute_values(
+                cur,
+                'INSERT INTO activity_events (user_id, event_type, source, metadata, created_at) VALUES %s',
+                events,
+                template='(%s, %s, %s, %s::jsonb, %s)'
+            )
+            execute_values(
+                cur,
+                '''INSERT INTO activity_rollups_hourly (user_id, event_type, bucket, event_count) VALUES %s
+                   ON CONFLICT (user_id, event_type, bucket)
+                   DO UPDATE SET event_count = activity_rollups_hourly.event_count + EXCLUDED.event_count''',
+                [(user_id or 0, event_type, bucket, count) for (user_id, event_type, bucket), count in hourly.items()]
+            )
+            execute_values(
+                cur,
+                '''INSERT INTO activity_rollups_daily (user_id, event_type, bucket, event_count) VALUES %s
+                   ON CONFLICT (user_id, event_type, bucket)
+                   DO UPDATE SET event_count = activity_rollups_daily.event_count + EXCLUDED.event_count''',
+                [(user_id or 0, event_type, bucket, count) for (user_id, event_type, bucket), count in daily.items()]
+            )
+            conn.commit()
+            cur.close()
+            if own and self.report is not None:
+                self.report(None)
+        except Exception as e:
+            if own and self.report is not None:
+                self.report(e)
+            if conn is not None and not own:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            print(f"activity flush dropped {len(events)} events: {e}")
+        finally:
+            if own and conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
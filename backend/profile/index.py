@@ -4,164 +4,138 @@ Args: event with httpMethod, body, headers; context with request_id
 Returns: HTTP response with user profile data or success status
 """
 
-import json
 import os
 import hashlib
-import psycopg2
 from typing import Dict, Any, Optional
+from db import DatabaseRouter
+from activity import ActivityEmitter
+from framework import Router, Request, Field, json_response, error_response
+from profiling import profiled
+
+database = DatabaseRouter()
 
 def get_db_connection():
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
+    return database.connect_primary()
+
+activity = ActivityEmitter('profile', get_db_connection, database.report_primary)
+
+PROFILE_FIELDS = (
+    ('displayName', 'display_name'),
+    ('avatarUrl', 'avatar_url'),
+    ('wallpaperUrl', 'wallpaper_url'),
+    ('theme', 'theme'),
+)
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Session-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    headers = event.get('headers', {})
-    session_token = headers.get('x-session-token') or headers.get('X-Session-Token')
-    
-    if not session_token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Session token required'})
-        }
-    
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT u.id, u.email, u.display_name, u.avatar_url, u.wallpaper_url, u.theme
-            FROM users u
-            JOIN sessions s ON u.id = s.user_id
-            WHERE s.token = %s AND s.expires_at > NOW()
-        """, (session_token,))
-        
-        user = cur.fetchone()
-        
-        if not user:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Invalid or expired session'})
-            }
-        
-        user_id, email, display_name, avatar_url, wallpaper_url, theme = user
-        
-        if method == 'GET':
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'id': user_id,
-                    'email': email,
-                    'displayName': display_name,
-                    'avatarUrl': avatar_url,
-                    'wallpaperUrl': wallpaper_url,
-                    'theme': theme or 'system'
-                })
-            }
-        
-        if method == 'PUT':
-            body_data = json.loads(event.get('body', '{}'))
-            
-            update_fields = []
-            params = []
-            
-            if 'displayName' in body_data:
-                update_fields.append('display_name = %s')
-                params.append(body_data['displayName'])
-            
-            if 'avatarUrl' in body_data:
-                update_fields.append('avatar_url = %s')
-                params.append(body_data['avatarUrl'])
-            
-            if 'wallpaperUrl' in body_data:
-                update_fields.append('wallpaper_url = %s')
-                params.append(body_data['wallpaperUrl'])
-            
-            if 'theme' in body_data:
-                update_fields.append('theme = %s')
-                params.append(body_data['theme'])
-            
-            if 'email' in body_data:
-                new_email = body_data['email']
-                cur.execute('SELECT id FROM users WHERE email = %s AND id != %s', (new_email, user_id))
-                if cur.fetchone():
-                    cur.close()
-                    conn.close()
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Email already in use'})
-                    }
-                update_fields.append('email = %s')
-                params.append(new_email)
-            
-            if 'password' in body_data:
-                update_fields.append('password_hash = %s')
-                params.append(hash_password(body_data['password']))
-            
-            if update_fields:
-                params.append(user_id)
-                query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = %s"
-                cur.execute(query, tuple(params))
-                conn.commit()
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'message': 'Profile updated'})
-            }
-        
-        if method == 'DELETE':
-            cur.execute('DELETE FROM sessions WHERE user_id = %s', (user_id,))
-            cur.execute('DELETE FROM files WHERE user_id = %s', (user_id,))
-            cur.execute('DELETE FROM users WHERE id = %s', (user_id,))
-            conn.commit()
+def get_user_from_token(request: Request) -> Optional[Dict]:
+    cur = request.read_db.cursor()
+    cur.execute("""
+        SELECT u.id, u.email, u.display_name, u.avatar_url, u.wallpaper_url, u.theme
+        FROM users u
+        JOIN sessions s ON u.id = s.user_id
+        WHERE s.token = %s AND s.expires_at > NOW()
+    """, (request.token,))
+    user = cur.fetchone()
+    cur.close()
+    if not user:
+        return None
+    user_id, email, display_name, avatar_url, wallpaper_url, theme = user
+    return {
+        'id': user_id,
+        'email': email,
+        'display_name': display_name,
+        'avatar_url': avatar_url,
+        'wallpaper_url': wallpaper_url,
+        'theme': theme
+    }
+
+MAX_PROFILE_BODY = int(os.environ.get('PROFILE_MAX_BODY_BYTES', str(16 * 1024 * 1024)))
+
+UPDATE_SCHEMA = {
+    'displayName': Field(str, nullable=True, strip=True, max_length=100),
+    'avatarUrl': Field(str, nullable=True, max_length=MAX_PROFILE_BODY),
+    'wallpaperUrl': Field(str, nullable=True, max_length=MAX_PROFILE_BODY),
+    'theme': Field(str, choices=('light', 'dark', 'system')),
+    'email': Field(str, strip=True, min_length=3, max_length=255, pattern=r'^[^@\s]+@[^@\s]+$'),
+    'password': Field(str, min_length=1, max_length=128),
+}
+
+router = Router(
+    connect=get_db_connection,
+    replicas=database,
+    authenticate=get_user_from_token,
+    missing_token_error='Session token required',
+    invalid_token_error='Invalid or expired session',
+    after_request=[activity.after_request]
+)
+
+@router.route('GET', path='/', auth=True)
+def get_profile(request: Request) -> Dict[str, Any]:
+    user = request.user
+    return json_response(200, {
+        'id': user['id'],
+        'email': user['email'],
+        'displayName': user['display_name'],
+        'avatarUrl': user['avatar_url'],
+        'wallpaperUrl': user['wallpaper_url'],
+        'theme': user['theme'] or 'system'
+    })
+
+@router.route('PUT', path='/', auth=True, schema=UPDATE_SCHEMA, max_body=MAX_PROFILE_BODY)
+def update_profile(request: Request) -> Dict[str, Any]:
+    user_id = request.user['id']
+    body_data = request.data
+    conn = request.db
+    cur = conn.cursor()
+
+    update_fields = []
+    params = []
+
+    for key, column in PROFILE_FIELDS:
+        if key in body_data:
+            update_fields.append(f"{column} = %s")
+            params.append(body_data[key])
+
+    if 'email' in body_data:
+        new_email = body_data['email']
+        cur.execute('SELECT id FROM users WHERE email = %s AND id != %s', (new_email, user_id))
+        if cur.fetchone():
             cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'message': 'Account deleted'})
-            }
-        
-        cur.close()
-        conn.close()
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
-        
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)})
-        }
+            return error_response(400, 'Email already in use')
+        update_fields.append('email = %s')
+        params.append(new_email)
+
+    if 'password' in body_data:
+        update_fields.append('password_hash = %s')
+        params.append(hash_password(body_data['password']))
+
+    if update_fields:
+        params.append(user_id)
+        query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = %s"
+        cur.execute(query, tuple(params))
+        conn.commit()
+
+        changed = [k for k in ('displayName', 'avatarUrl', 'wallpaperUrl', 'theme', 'email', 'password') if k in body_data]
+        activity.emit(user_id, 'profile.updated', {'fields': changed})
+
+    cur.close()
+    return json_response(200, {'success': True, 'message': 'Profile updated'})
+
+@router.route('DELETE', path='/', auth=True)
+def delete_account(request: Request) -> Dict[str, Any]:
+    user_id = request.user['id']
+    conn = request.db
+    cur = conn.cursor()
+    cur.execute('DELETE FROM sessions WHERE user_id = %s', (user_id,))
+    cur.execute('DELETE FROM files WHERE user_id = %s', (user_id,))
+    cur.execute('DELETE FROM users WHERE id = %s', (user_id,))
+    conn.commit()
+    cur.close()
+
+    activity.emit(user_id, 'account.deleted')
+
+    return json_response(200, {'success': True, 'message': 'Account deleted'})
+
+handler = profiled(router, 'profile')
@@ -0,0 +1,342 @@
+'''
+Business: Database connections for backend functions - primary for writes, optional read replicas,
+timeouts bounded by the invocation deadline and a circuit breaker around the primary
+Args: DATABASE_URL, optional DATABASE_REPLICA_URLS (comma separated) and tuning env vars
+Returns: psycopg2 connections chosen per request
+
+This file is copied verbatim into every function directory because each
+function is deployed as a standalone bundle; keep the copies identical
+with scripts/sync_shared.py.
+'''
+
+import json
+import math
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+import psycopg2
+import psycopg2.extensions
+from framework import HttpError
+
+READ_YOUR_WRITES_SEC = float(os.environ.get('REPLICA_READ_YOUR_WRITES_SEC', '5'))
+MAX_REPLICA_LAG_SEC = float(os.environ.get('REPLICA_MAX_LAG_SEC', '2'))
+LAG_CHECK_INTERVAL_SEC = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL_SEC', '5'))
+REPLICA_COOLDOWN_SEC = float(os.environ.get('REPLICA_COOLDOWN_SEC', '30'))
+MAX_TRACKED_WRITERS = 10000
+
+CONNECT_TIMEOUT_SEC = int(os.environ.get('DB_CONNECT_TIMEOUT_SEC', '5'))
+STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '10000'))
+# Time kept back from the invocation deadline to build and return the error response
+DEADLINE_MARGIN_MS = int(os.environ.get('DB_DEADLINE_MARGIN_MS', '500'))
+BREAKER_FAILURES = int(os.environ.get('DB_BREAKER_FAILURES', '5'))
+BREAKER_RESET_SEC = float(os.environ.get('DB_BREAKER_RESET_SEC', '30'))
+# libpq treats any connect_timeout below 2 seconds as 2
+MIN_CONNECT_TIMEOUT_SEC = 2
+MIN_STATEMENT_TIMEOUT_MS = 100
+# OperationalError codes besides class 08 that mean the server dropped or refused the
+# connection: admin/crash shutdown, cannot connect now, too many connections
+CONNECTION_FAILURE_CODES = frozenset(['57P01', '57P02', '57P03', '53300'])
+
+# A WAL position as the primary prints it, e.g. 16/B374D848
+LSN_RE = re.compile(r'^[0-9A-Fa-f]{1,8}/[0-9A-Fa-f]{1,8}$')
+
+# pg_last_wal_replay_lsn() is NULL on a server that is not in recovery; such a server has every write
+REPLAYED_SQL = 'SELECT NOT pg_is_in_recovery() OR pg_last_wal_replay_lsn() >= %s::pg_lsn AS replayed'
+
+# Zero when the replica has replayed everything it received, so an idle primary does not look like lag
+LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag
+'''
+
+
+class DatabaseUnavailable(HttpError):
+    def __init__(self, retry_after: int):
+        super().__init__(503, 'Service temporarily unavailable', {'Retry-After': str(retry_after)})
+
+
+class CircuitBreaker:
+    '''Per-instance breaker for the primary. BREAKER_FAILURES consecutive failed requests
+    (connection failures, statement timeouts, dropped connections) open it: requests then
+    get 503 without touching the database for BREAKER_RESET_SEC, after which a single trial
+    request decides whether it closes. Only a request that used the primary and finished
+    cleanly resets the count, so a brownout where connects succeed but queries time out
+    still trips it. State changes are logged as one JSON line with the counters so far.'''
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name: str = 'primary', failures: int = BREAKER_FAILURES, reset_sec: float = BREAKER_RESET_SEC):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset_sec = reset_sec
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.metrics = {'trips': 0, 'rejected': 0, 'failures': 0}
+
+    def before_call(self):
+        if self.state == self.CLOSED:
+            return
+        now = time.monotonic()
+        remaining = self.opened_at + self.reset_sec - now
+        if remaining <= 0:
+            # Let exactly one trial through; others keep failing fast until it reports back.
+            # A trial that never reported (it failed for an unrelated reason) is replaced.
+            self.opened_at = now
+            self._transition(self.HALF_OPEN)
+            return
+        self.metrics['rejected'] += 1
+        raise DatabaseUnavailable(max(1, math.ceil(remaining)))
+
+    def record_success(self):
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self.metrics['failures'] += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self.metrics['trips'] += 1
+            self._transition(self.OPEN)
+
+    def _transition(self, state: str):
+        self.state = state
+        print(json.dumps({'metric': 'db_circuit', 'breaker': self.name, 'state': state, **self.metrics}))
+
+
+class Replica:
+    __slots__ = ('dsn', 'checked_at', 'unavailable_until')
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.checked_at = 0.0
+        self.unavailable_until = 0.0
+
+
+class DatabaseRouter:
+    '''Sends reads to replicas and everything else to the primary.
+
+    A replica is used only while its measured lag is under REPLICA_MAX_LAG_SEC (checked at
+    most every REPLICA_LAG_CHECK_INTERVAL_SEC) and it accepts connections; otherwise it is
+    skipped for REPLICA_COOLDOWN_SEC and reads fall back to the primary.
+
+    Read-your-writes does not depend on which instance took the write: write_position()
+    gives the primary's WAL position after a write, the client sends the latest one back
+    (the Router uses the X-Last-Write header), and connect_read() only picks a replica that
+    has replayed up to it. A user whose write went through this instance also skips
+    replicas for REPLICA_READ_YOUR_WRITES_SEC, which saves the replica round trip.
+
+    start_request(context) records the invocation deadline; every connection after that
+    gets a connect_timeout and statement_timeout that fit in the time left, so a slow
+    database turns into a fast error instead of an instance blocked until it is killed.
+    '''
+
+    def __init__(self, cursor_factory: Any = None, primary_dsn: Optional[str] = None,
+                 replica_dsns: Optional[List[str]] = None):
+        self.cursor_factory = cursor_factory
+        self.primary_dsn = primary_dsn or os.environ.get('DATABASE_URL')
+        if replica_dsns is None:
+            replica_dsns = [d.strip() for d in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if d.strip()]
+        self.replicas = [Replica(dsn) for dsn in replica_dsns]
+        self.next_replica = 0
+        self.recent_writers: Dict[int, float] = {}
+        self.breaker = CircuitBreaker()
+        self.deadline: Optional[float] = None
+
+    def start_request(self, context: Any):
+        get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+        self.deadline = None
+        if get_remaining is not None:
+            try:
+                self.deadline = time.monotonic() + (get_remaining() - DEADLINE_MARGIN_MS) / 1000
+            except Exception:
+                pass
+
+    def timeouts(self):
+        '''(connect_timeout seconds, statement_timeout ms) for the time left in this invocation'''
+        if self.deadline is None:
+            return CONNECT_TIMEOUT_SEC, STATEMENT_TIMEOUT_MS
+        remaining_ms = (self.deadline - time.monotonic()) * 1000
+        if remaining_ms <= 0:
+            raise DatabaseUnavailable(1)
+        connect_timeout = max(MIN_CONNECT_TIMEOUT_SEC, min(CONNECT_TIMEOUT_SEC, int(remaining_ms // 1000)))
+        statement_timeout = max(MIN_STATEMENT_TIMEOUT_MS, min(STATEMENT_TIMEOUT_MS, int(remaining_ms)))
+        return connect_timeout, statement_timeout
+
+    def finish_request(self):
+        # Connections opened outside a request use the default timeouts
+        self.deadline = None
+
+    def _connect(self, dsn: str, timeouts: Optional[tuple] = None):
+        connect_timeout, statement_timeout = timeouts or self.timeouts()
+        kwargs: Dict[str, Any] = {
+            'connect_timeout': connect_timeout,
+            'options': f'-c statement_timeout={statement_timeout}'
+        }
+        if self.cursor_factory is not None:
+            kwargs['cursor_factory'] = self.cursor_factory
+        return psycopg2.connect(dsn, **kwargs)
+
+    def connect_primary(self):
+        timeouts = self.timeouts()
+        self.breaker.before_call()
+        try:
+            conn = self._connect(self.primary_dsn, timeouts)
+        except psycopg2.OperationalError as e:
+            print(f"Primary connection failed: {e}".strip())
+            raise self._unavailable() from e
+        return conn
+
+    def observe_success(self):
+        '''Called when a request that used the primary finished without a database error'''
+        self.breaker.record_success()
+
+    def observe_error(self, error: Exception, primary_conn: Any = None, on_replica: bool = False) -> Optional[DatabaseUnavailable]:
+        '''Called for errors escaping a handler. Statement timeouts and dropped connections
+        are reported as 503 rather than a generic 500; only those from the primary
+        connection count against the breaker, a failing replica never trips it. Any other
+        error on a request that used the primary (a deadlock, a bug) means the primary
+        answered, which counts as a success.'''
+        if not self.is_outage(error):
+            if primary_conn is not None:
+                self.breaker.record_success()
+            return None
+        failed_conn = getattr(getattr(error, 'cursor', None), 'connection', None)
+        if failed_conn is not None:
+            from_primary = primary_conn is not None and failed_conn is primary_conn
+        else:
+            from_primary = not on_replica
+        if not from_primary:
+            return DatabaseUnavailable(1)
+        return self._unavailable()
+
+    def report_primary(self, error: Optional[Exception] = None):
+        '''For connect_primary() connections used outside a request (activity flushes and
+        rate-limit buckets with their own connection): tells the breaker how the work went,
+        so a half-open trial always reports back whoever made it'''
+        if isinstance(error, DatabaseUnavailable):
+            # Already counted by connect_primary, or the breaker was open
+            return
+        if error is not None and self.is_outage(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _unavailable(self) -> DatabaseUnavailable:
+        self.breaker.record_failure()
+        if self.breaker.state == CircuitBreaker.OPEN:
+            return DatabaseUnavailable(max(1, math.ceil(self.breaker.reset_sec)))
+        return DatabaseUnavailable(1)
+
+    def note_write(self, user_id: Optional[int]):
+        if user_id is None:
+            return
+        now = time.monotonic()
+        self.recent_writers[user_id] = now
+        if len(self.recent_writers) > MAX_TRACKED_WRITERS:
+            cutoff = now - READ_YOUR_WRITES_SEC
+            self.recent_writers = {k: v for k, v in self.recent_writers.items() if v > cutoff}
+
+    def wrote_recently(self, user_id: Optional[int]) -> bool:
+        if user_id is None:
+            return False
+        written_at = self.recent_writers.get(user_id)
+        return written_at is not None and time.monotonic() - written_at < READ_YOUR_WRITES_SEC
+
+    def write_position(self, conn: Any) -> Optional[str]:
+        '''The primary's current WAL position, read on conn after a write has committed;
+        None without replicas or when it cannot be read (the write itself is done)'''
+        if not self.replicas:
+            return None
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT pg_current_wal_lsn()::text AS lsn')
+            row = cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return row['lsn'] if isinstance(row, dict) else row[0]
+        except psycopg2.Error as e:
+            print(f"Reading the write position failed: {e}".strip())
+            return None
+
+    def connect_read(self, user_id: Optional[int] = None, min_lsn: Optional[str] = None):
+        '''Returns (connection, Replica it came from or None for the primary). With min_lsn
+        (a write_position() the client got back) only a replica that has replayed it is used.'''
+        if not self.replicas or self.wrote_recently(user_id):
+            return self.connect_primary(), None
+        if min_lsn is not None and not LSN_RE.match(min_lsn):
+            min_lsn = None
+
+        now = time.monotonic()
+        count = len(self.replicas)
+        for offset in range(count):
+            replica = self.replicas[(self.next_replica + offset) % count]
+            if replica.unavailable_until > now:
+                continue
+            try:
+                conn = self._connect(replica.dsn)
+            except psycopg2.Error:
+                replica.unavailable_until = now + REPLICA_COOLDOWN_SEC
+                continue
+            if now - replica.checked_at >= LAG_CHECK_INTERVAL_SEC:
+                if not self._lag_ok(conn):
+                    conn.close()
+                    replica.unavailable_until = now + REPLICA_COOLDOWN_SEC
+                    continue
+                replica.checked_at = now
+            if min_lsn is not None and not self._replayed(conn, min_lsn):
+                # Healthy but behind this client's last write; another replica may have it
+                conn.close()
+                continue
+            self.next_replica = (self.next_replica + offset + 1) % count
+            return conn, replica
+
+        return self.connect_primary(), None
+
+    def replica_failed(self, replica: Replica):
+        replica.unavailable_until = time.monotonic() + REPLICA_COOLDOWN_SEC
+
+    @staticmethod
+    def is_connection_error(error: Exception) -> bool:
+        return isinstance(error, psycopg2.OperationalError)
+
+    @staticmethod
+    def is_outage(error: Exception) -> bool:
+        '''Dropped or refused connections and statement timeouts. Deadlocks and serialization
+        failures (TransactionRollbackError) are OperationalErrors too, but a database that
+        reports them is up.'''
+        if isinstance(error, psycopg2.extensions.QueryCanceledError):
+            return True
+        if not isinstance(error, psycopg2.OperationalError) or isinstance(error, psycopg2.extensions.TransactionRollbackError):
+            return False
+        code = error.pgcode
+        return code is None or code.startswith('08') or code in CONNECTION_FAILURE_CODES
+
+    def _replayed(self, conn, lsn: str) -> bool:
+        try:
+            cur = conn.cursor()
+            cur.execute(REPLAYED_SQL, (lsn,))
+            row = cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return bool(row['replayed'] if isinstance(row, dict) else row[0])
+        except psycopg2.Error:
+            return False
+
+    def _lag_ok(self, conn) -> bool:
+        try:
+            cur = conn.cursor()
+            cur.execute(LAG_SQL)
+            row = cur.fetchone()
+            lag = float(row['lag'] if isinstance(row, dict) else row[0])
+            cur.close()
+            conn.rollback()
+            return lag <= MAX_REPLICA_LAG_SEC
+        except psycopg2.Error:
+            return False
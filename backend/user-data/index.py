@@ -1,125 +1,86 @@
+'''
+Business: User data storage for platforms and games
+Args: event with httpMethod, body, headers
+Returns: HTTP response with user's platforms and games
+'''
+
 import json
-import os
-import psycopg2
 from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from activity import ActivityEmitter
+from db import DatabaseRouter
+from framework import Router, Request, HttpError, Field, json_response
+from profiling import profiled
+
+database = DatabaseRouter(cursor_factory=RealDictCursor)
+
+def get_db_connection():
+    if not database.primary_dsn:
+        raise HttpError(500, 'Database not configured')
+    return database.connect_primary()
+
+activity = ActivityEmitter('user-data', get_db_connection, database.report_primary)
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    '''
-    Business: User data storage for platforms and games
-    Args: event with httpMethod, body, headers
-    Returns: HTTP response with user's platforms and games
-    '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    headers = event.get('headers', {})
-    auth_token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
-    
-    if not auth_token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'No auth token provided'})
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Database not configured'})
-        }
-    
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    safe_token = auth_token.replace("'", "''")
-    cur.execute(f"SELECT user_id FROM user_sessions WHERE token = '{safe_token}' AND expires_at > NOW()")
+def get_user_from_token(request: Request) -> Optional[Dict]:
+    cur = request.read_db.cursor()
+    cur.execute(
+        "SELECT user_id AS id FROM sessions WHERE token = %s AND expires_at > NOW()",
+        (request.token,)
+    )
     session = cur.fetchone()
-    
-    if not session:
-        cur.close()
-        conn.close()
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Invalid or expired token'})
-        }
-    
-    user_id = session['user_id']
-    
-    if method == 'GET':
-        cur.execute(f"SELECT platforms, games FROM user_data WHERE user_id = {user_id}")
-        result = cur.fetchone()
-        
-        cur.close()
-        conn.close()
-        
-        if result:
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({
-                    'platforms': result['platforms'] or [],
-                    'games': result['games'] or []
-                })
-            }
-        else:
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'platforms': [], 'games': []})
-            }
-    
-    elif method == 'POST' or method == 'PUT':
-        body_data = json.loads(event.get('body', '{}'))
-        platforms = body_data.get('platforms', [])
-        games = body_data.get('games', [])
-        
-        platforms_json = json.dumps(platforms).replace("'", "''")
-        games_json = json.dumps(games).replace("'", "''")
-        
-        cur.execute(f"""
-            INSERT INTO user_data (user_id, platforms, games)
-            VALUES ({user_id}, '{platforms_json}', '{games_json}')
-            ON CONFLICT (user_id) 
-            DO UPDATE SET platforms = EXCLUDED.platforms, games = EXCLUDED.games, updated_at = NOW()
-        """)
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'success': True})
-        }
-    
     cur.close()
-    conn.close()
-    
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'isBase64Encoded': False,
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
\ No newline at end of file
+    return session
+
+SAVE_SCHEMA = {
+    'platforms': Field(list, default=list, max_items=100, items=(dict, str)),
+    'games': Field(list, default=list, max_items=500, items=(dict, str)),
+}
+
+router = Router(
+    connect=get_db_connection,
+    replicas=database,
+    authenticate=get_user_from_token,
+    missing_token_error='No auth token provided',
+    after_request=[activity.after_request]
+)
+
+@router.route('GET', path='/', auth=True)
+def get_user_data(request: Request) -> Dict[str, Any]:
+    # Read from the primary: the client saves these lists back whole, so a stale copy
+    # from a replica would undo the user's latest save
+    request.use_primary_for_reads()
+    cur = request.read_db.cursor()
+    cur.execute("SELECT platforms, games FROM user_data WHERE user_id = %s", (request.user['id'],))
+    result = cur.fetchone()
+    cur.close()
+
+    if result:
+        return json_response(200, {
+            'platforms': result['platforms'] or [],
+            'games': result['games'] or []
+        })
+    return json_response(200, {'platforms': [], 'games': []})
+
+@router.route('PUT', path='/', auth=True, schema=SAVE_SCHEMA, max_body=256 * 1024)
+@router.route('POST', path='/', auth=True, schema=SAVE_SCHEMA, max_body=256 * 1024)
+def save_user_data(request: Request) -> Dict[str, Any]:
+    user_id = request.user['id']
+    platforms = request.data['platforms']
+    games = request.data['games']
+
+    conn = request.db
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO user_data (user_id, platforms, games)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (user_id)
+        DO UPDATE SET platforms = EXCLUDED.platforms, games = EXCLUDED.games, updated_at = NOW()
+    """, (user_id, json.dumps(platforms), json.dumps(games)))
+    conn.commit()
+    cur.close()
+
+    activity.emit(user_id, 'userdata.saved', {'platforms': len(platforms), 'games': len(games)})
+
+    return json_response(200, {'success': True})
+
+handler = profiled(router, 'user-data')
@@ -0,0 +1,139 @@
+'''
+Business: Opt-in CPU and allocation profiling of sampled handler invocations
+Args: PROFILE_SAMPLE_RATE, PROFILE_DEBUG_SECRET (enables the signed X-Debug-Profile header),
+      PROFILE_OUTPUT_DIR, PROFILE_TOP_N env vars
+Returns: The wrapped handler's response, tagged with X-Profile-Id when it was profiled
+
+This file is copied verbatim into every function directory because each
+function is deployed as a standalone bundle; keep the copies identical
+with scripts/sync_shared.py.
+'''
+
+import cProfile
+import hashlib
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import time
+import tracemalloc
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+DEBUG_SECRET = os.environ.get('PROFILE_DEBUG_SECRET', '')
+OUTPUT_DIR = os.environ.get('PROFILE_OUTPUT_DIR', '')
+TOP_N = int(os.environ.get('PROFILE_TOP_N', '25'))
+DEBUG_HEADERS = ('X-Debug-Profile', 'x-debug-profile')
+TRACEMALLOC_FRAMES = 5
+
+
+def sign_debug_token(secret: str, ttl_sec: int = 600) -> str:
+    '''Value for the X-Debug-Profile header: "<expires>.<hmac-sha256 of expires>"'''
+    expires = str(int(time.time()) + ttl_sec)
+    signature = hmac.new(secret.encode(), expires.encode(), hashlib.sha256).hexdigest()
+    return f"{expires}.{signature}"
+
+
+def valid_debug_token(token: Optional[str], secret: str = DEBUG_SECRET) -> bool:
+    if not token or not secret:
+        return False
+    expires, _, signature = token.partition('.')
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    expected = hmac.new(secret.encode(), expires.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def debug_token(event: Dict[str, Any]) -> Optional[str]:
+    headers = event.get('headers') or {}
+    for name in DEBUG_HEADERS:
+        value = headers.get(name)
+        if value:
+            return value
+    return None
+
+
+def cpu_report(profiler: cProfile.Profile) -> str:
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('cumulative').print_stats(TOP_N)
+    return out.getvalue()
+
+
+def allocation_report(snapshot: tracemalloc.Snapshot) -> list:
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+    return [
+        {'size_kb': round(stat.size / 1024, 1), 'count': stat.count, 'where': str(stat.traceback[0])}
+        for stat in snapshot.statistics('lineno')[:TOP_N]
+    ]
+
+
+def profiled(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]], name: str):
+    '''Wraps a cloud function handler. A request is profiled when it wins the
+    PROFILE_SAMPLE_RATE draw or carries a valid signed X-Debug-Profile header; everything
+    else goes straight to the handler. cProfile stats and the top tracemalloc allocations
+    are written to PROFILE_OUTPUT_DIR (a .prof file loadable with pstats plus a .json
+    summary) or, without a directory, printed to the function log as one JSON line.'''
+    if SAMPLE_RATE <= 0 and not DEBUG_SECRET:
+        return handler
+
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        if event.get('httpMethod') == 'OPTIONS':
+            return handler(event, context)
+        sampled = SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+        if not sampled and not valid_debug_token(debug_token(event)):
+            return handler(event, context)
+
+        profile_id = getattr(context, 'request_id', None) or uuid.uuid4().hex
+        tracing = not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            response = handler(event, context)
+        finally:
+            profiler.disable()
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if tracing:
+                tracemalloc.stop()
+
+        try:
+            summary = {
+                'profile_id': profile_id,
+                'function': name,
+                'method': event.get('httpMethod'),
+                'action': (event.get('queryStringParameters') or {}).get('action'),
+                'status': response.get('statusCode'),
+                'elapsed_ms': elapsed_ms,
+                'peak_kb': round(peak / 1024, 1),
+                'allocations': allocation_report(snapshot),
+            }
+            if OUTPUT_DIR:
+                os.makedirs(OUTPUT_DIR, exist_ok=True)
+                base = os.path.join(OUTPUT_DIR, f"{int(time.time())}-{name}-{profile_id}")
+                profiler.dump_stats(base + '.prof')
+                with open(base + '.json', 'w', encoding='utf-8') as f:
+                    json.dump({**summary, 'cpu': cpu_report(profiler)}, f, indent=2)
+            else:
+                print(json.dumps({'metric': 'profile', **summary, 'cpu': cpu_report(profiler)}))
+        except Exception as e:
+            print(f"Profile report failed: {e}")
+            return response
+
+        headers = dict(response.get('headers') or {})
+        headers['X-Profile-Id'] = profile_id
+        exposed = headers.get('Access-Control-Expose-Headers')
+        headers['Access-Control-Expose-Headers'] = f"{exposed}, X-Profile-Id" if exposed else 'X-Profile-Id'
+        return {**response, 'headers': headers}
+
+    return wrapper
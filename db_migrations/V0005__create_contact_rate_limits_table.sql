@@ -0,0 +1,8 @@
+-- Shared token buckets for the public contact endpoint (CONTACT_RATE_LIMIT_STORE=postgres)
+CREATE TABLE IF NOT EXISTS contact_rate_limits (
+    bucket_key VARCHAR(320) PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_contact_rate_limits_updated_at ON contact_rate_limits(updated_at);
@@ -0,0 +1,28 @@
+-- Append-only activity event trail written in batches by every backend function
+CREATE TABLE IF NOT EXISTS activity_events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER,
+    event_type VARCHAR(50) NOT NULL,
+    source VARCHAR(50) NOT NULL,
+    metadata JSONB DEFAULT '{}'::jsonb,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_activity_events_user_created ON activity_events(user_id, created_at DESC);
+
+-- Precomputed counters for dashboards; user_id 0 collects anonymous events (public contact form)
+CREATE TABLE IF NOT EXISTS activity_rollups_hourly (
+    user_id INTEGER NOT NULL,
+    event_type VARCHAR(50) NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    event_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, event_type, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS activity_rollups_daily (
+    user_id INTEGER NOT NULL,
+    event_type VARCHAR(50) NOT NULL,
+    bucket DATE NOT NULL,
+    event_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, event_type, bucket)
+);
@@ -0,0 +1,11 @@
+-- Built online: apply with scripts/migrate.py, which runs CONCURRENTLY statements outside a transaction
+
+-- Covers the files listing (WHERE user_id = ? ORDER BY created_at DESC) in a single index scan
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_files_user_created ON files(user_id, created_at DESC);
+
+-- Unread inbox lookups; replaces the low-selectivity boolean index from V0004
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_contact_messages_unread ON contact_messages(created_at DESC) WHERE is_read = FALSE;
+DROP INDEX CONCURRENTLY IF EXISTS idx_contact_messages_is_read;
+
+-- sessions.token is already UNIQUE, so this duplicate index only slows down logins
+DROP INDEX CONCURRENTLY IF EXISTS idx_sessions_token;
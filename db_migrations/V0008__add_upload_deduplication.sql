@@ -0,0 +1,17 @@
+-- Content hash of each upload; existing rows stay NULL and are not deduplicated against
+ALTER TABLE files ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+
+-- One stored copy per user and content; also serves the hash lookup done before decoding an upload
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_files_user_content_hash
+    ON files(user_id, content_hash) WHERE content_hash IS NOT NULL;
+
+-- Short-lived Idempotency-Key records for upload retries (expire after 24 hours)
+CREATE TABLE IF NOT EXISTS upload_idempotency_keys (
+    user_id INTEGER NOT NULL,
+    idempotency_key VARCHAR(255) NOT NULL,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_idempotency_keys_created_at ON upload_idempotency_keys(created_at);
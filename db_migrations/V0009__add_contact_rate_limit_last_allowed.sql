@@ -0,0 +1,3 @@
+-- Whether the last take from a bucket was allowed; rejected takes no longer charge a token,
+-- so the remaining token count alone cannot tell an allowed take from a rejected one
+ALTER TABLE contact_rate_limits ADD COLUMN IF NOT EXISTS last_allowed BOOLEAN NOT NULL DEFAULT TRUE;
@@ -0,0 +1,92 @@
+'''
+Business: Check the contact token-bucket arithmetic of both bucket stores in backend/contact
+Args: optional DATABASE_URL (migrated through V0009) to also check PostgresBucketStore
+Returns: Exit code 0 when every check passes; prints one line per check
+
+Both stores must agree: a rejected take does not charge a token, and a client that waits
+exactly the returned Retry-After is allowed again.
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'contact'))
+
+from spam_filter import MemoryBucketStore, PostgresBucketStore
+
+CAPACITY = 2.0
+REFILL_PER_SEC = 10 / 3600
+KEY = 'check:rate-limits'
+
+
+def run_scenario(take, wait, check, label: str):
+    '''take() -> (allowed, retry_after); wait(seconds) moves the bucket's clock'''
+    first, second, third = take(), take(), take()
+    check(f'{label}: burst of {int(CAPACITY)} allowed', first[0] and second[0])
+    check(f'{label}: next take rejected with Retry-After', not third[0] and third[1] > 0)
+
+    retry_after = third[1]
+    again = take()
+    check(f'{label}: immediate retry is rejected with the same Retry-After',
+          not again[0] and abs(again[1] - retry_after) <= 1)
+
+    wait(retry_after)
+    check(f'{label}: allowed after waiting exactly Retry-After', take()[0])
+    check(f'{label}: rejected again once the refilled token is spent', not take()[0])
+
+
+def main():
+    failures = 0
+
+    def check(name: str, ok: bool):
+        nonlocal failures
+        failures += 0 if ok else 1
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+
+    memory = MemoryBucketStore()
+    clock = [1_000_000.0]
+
+    def memory_wait(seconds: float):
+        clock[0] += seconds
+
+    run_scenario(lambda: memory.take(KEY, CAPACITY, REFILL_PER_SEC, clock[0]), memory_wait, check, 'memory')
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        print('skip PostgresBucketStore checks: DATABASE_URL is not set')
+    else:
+        import psycopg2
+        conn = psycopg2.connect(dsn)
+
+        def delete_bucket():
+            cur = conn.cursor()
+            cur.execute('DELETE FROM contact_rate_limits WHERE bucket_key = %s', (KEY,))
+            conn.commit()
+            cur.close()
+
+        def postgres_wait(seconds: float):
+            # Moving updated_at back is the same as the bucket sitting idle that long
+            cur = conn.cursor()
+            cur.execute(
+                'UPDATE contact_rate_limits SET updated_at = updated_at - make_interval(secs => %s) WHERE bucket_key = %s',
+                (seconds, KEY)
+            )
+            conn.commit()
+            cur.close()
+
+        # _take_shared rather than take_many: take_many would hide SQL errors behind its
+        # in-memory fallback and the checks would pass against the wrong store
+        store = PostgresBucketStore(lambda: conn)
+        delete_bucket()
+        try:
+            run_scenario(lambda: store._take_shared([(KEY, CAPACITY, REFILL_PER_SEC)], conn)[0],
+                         postgres_wait, check, 'postgres')
+        finally:
+            delete_bucket()
+            conn.close()
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+'''
+Business: Smoke-check read-replica routing in backend/*/db.py against real Postgres instances
+Args: DATABASE_URL (primary) and DATABASE_REPLICA_URLS (one or more replicas), e.g. two local
+      instances on ports 5432 and 5433
+Returns: Exit code 0 when every check passes; prints one line per check
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'auth'))
+
+from db import DatabaseRouter
+
+UNREACHABLE_DSN = 'postgresql://nobody@127.0.0.1:1/none?connect_timeout=1'
+
+
+def server_port(conn) -> int:
+    cur = conn.cursor()
+    cur.execute('SELECT inet_server_port()')
+    port = cur.fetchone()[0]
+    cur.close()
+    return port
+
+
+def main():
+    primary = os.environ.get('DATABASE_URL')
+    replicas = [d for d in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if d]
+    if not primary or not replicas:
+        print('Set DATABASE_URL and DATABASE_REPLICA_URLS', file=sys.stderr)
+        sys.exit(2)
+
+    failures = 0
+
+    def check(name: str, ok: bool):
+        nonlocal failures
+        failures += 0 if ok else 1
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+
+    router = DatabaseRouter(primary_dsn=primary, replica_dsns=replicas)
+    primary_conn = router.connect_primary()
+    primary_port = server_port(primary_conn)
+    primary_conn.close()
+
+    conn, replica = router.connect_read()
+    check('anonymous read goes to a replica', replica is not None and server_port(conn) != primary_port)
+    conn.close()
+
+    router.note_write(42)
+    conn, replica = router.connect_read(42)
+    check('read after own write goes to the primary', replica is None and server_port(conn) == primary_port)
+    conn.close()
+
+    conn, replica = router.connect_read(43)
+    check('other users still read from replicas', replica is not None)
+    conn.close()
+
+    primary_conn = router.connect_primary()
+    position = router.write_position(primary_conn)
+    primary_conn.close()
+    check('write position is reported with replicas configured', bool(position))
+
+    conn, replica = router.connect_read(None, 'FFFFFFFF/FFFFFFFF')
+    check('read waiting for an unreplayed write goes to the primary', replica is None and server_port(conn) == primary_port)
+    conn.close()
+
+    conn, replica = router.connect_read(None, 'not-a-position')
+    check('malformed write position is ignored', replica is not None)
+    conn.close()
+
+    broken = DatabaseRouter(primary_dsn=primary, replica_dsns=[UNREACHABLE_DSN])
+    conn, replica = broken.connect_read()
+    check('unreachable replica falls back to the primary', replica is None and server_port(conn) == primary_port)
+    conn.close()
+    check('unreachable replica is put in cooldown', broken.replicas[0].unavailable_until > 0)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
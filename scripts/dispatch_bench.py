@@ -0,0 +1,131 @@
+'''
+Business: Micro-benchmark of per-request dispatch overhead - legacy if/elif handlers vs framework.Router
+Args: optional iteration count as the first CLI argument
+Returns: Prints microseconds per request for each scenario
+
+Database access is left out on purpose (endpoints return immediately), so the
+numbers isolate routing, preflight, token extraction and response building.
+Run from the repository root: python scripts/dispatch_bench.py
+
+Result: the router does not make dispatch cheaper. Only the preflight is faster
+(about 0.2 us vs 0.4 us); every other route costs roughly 1-2 us more per request
+than the old if/elif chain, mostly from building the Request object. The saving the
+framework brings is the database connection shared by auth and the endpoint, which
+is orders of magnitude larger than that and is not measured here.
+'''
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'contact'))
+
+from framework import Router, Request, json_response
+
+EVENTS = {
+    'preflight': {'httpMethod': 'OPTIONS', 'path': '/'},
+    'list': {'httpMethod': 'GET', 'path': '/', 'headers': {'X-Auth-Token': 't'}},
+    'submit': {'httpMethod': 'POST', 'path': '/', 'headers': {}, 'body': '{"name": "a", "email": "b", "message": "c"}'},
+    'read': {'httpMethod': 'PUT', 'path': '/42/read', 'headers': {'X-Auth-Token': 't'}},
+    'reply': {'httpMethod': 'POST', 'path': '/42/reply', 'headers': {'X-Auth-Token': 't'}, 'body': '{"reply": "ok"}'},
+    'delete': {'httpMethod': 'DELETE', 'path': '/42', 'headers': {'X-Auth-Token': 't'}},
+}
+
+
+def legacy_handler(event, context):
+    '''Dispatch structure of the pre-framework contact handler, with DB calls removed'''
+    method = event.get('httpMethod', 'POST')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+
+    headers = event.get('headers', {})
+    token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
+    path = event.get('path', '')
+
+    if method == 'GET':
+        if not token:
+            return {'statusCode': 401, 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Authentication required'})}
+        return {'statusCode': 200, 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps([], default=str)}
+
+    if method == 'POST' and not path.endswith('/reply'):
+        body = json.loads(event.get('body', '{}'))
+        body.get('name', '').strip()
+        return {'statusCode': 200, 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True, 'id': 1})}
+
+    if not token:
+        return {'statusCode': 401, 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Authentication required'})}
+
+    path_parts = [p for p in path.split('/') if p and p != 'read' and p != 'reply']
+    message_id = path_parts[-1] if path_parts else None
+
+    if path.endswith('/read') and method == 'PUT':
+        return {'statusCode': 200, 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True, 'id': message_id})}
+    elif path.endswith('/reply') and method == 'POST':
+        body = json.loads(event.get('body', '{}'))
+        body.get('reply', '').strip()
+        return {'statusCode': 200, 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True, 'id': message_id})}
+    elif method == 'DELETE':
+        return {'statusCode': 200, 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True, 'id': message_id})}
+
+    return {'statusCode': 404, 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Not found'})}
+
+
+def build_router() -> Router:
+    router = Router(authenticate=lambda request: {'id': 1})
+
+    @router.route('GET', path='/', auth=True)
+    def list_messages(request: Request):
+        return json_response(200, [])
+
+    @router.route('POST', path='/')
+    def submit(request: Request):
+        request.body.get('name', '').strip()
+        return json_response(200, {'success': True, 'id': 1})
+
+    @router.route('PUT', path='/{message_id}/read', auth=True)
+    def read(request: Request):
+        return json_response(200, {'success': True, 'id': request.path_params['message_id']})
+
+    @router.route('POST', path='/{message_id}/reply', auth=True)
+    def reply(request: Request):
+        request.body.get('reply', '').strip()
+        return json_response(200, {'success': True, 'id': request.path_params['message_id']})
+
+    @router.route('DELETE', path='/{message_id}', auth=True)
+    def delete(request: Request):
+        return json_response(200, {'success': True, 'id': request.path_params['message_id']})
+
+    return router
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    router = build_router()
+    print(f"{'scenario':<10} {'legacy us':>10} {'router us':>10}")
+    for name, event in EVENTS.items():
+        legacy = min(timeit.repeat(lambda: legacy_handler(event, None), number=iterations, repeat=3))
+        routed = min(timeit.repeat(lambda: router(event, None), number=iterations, repeat=3))
+        print(f"{name:<10} {legacy / iterations * 1e6:>10.2f} {routed / iterations * 1e6:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
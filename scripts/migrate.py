@@ -0,0 +1,327 @@
+'''
+Business: Apply db_migrations/V*.sql in order without write downtime
+Args: DATABASE_URL env var; CLI flags --dry-run, --target N, --baseline N, --lock-timeout
+Returns: Exit code 0 when every pending migration applied; prints per-step timing
+
+Each file is split into steps:
+  * CREATE/DROP INDEX CONCURRENTLY and REINDEX ... CONCURRENTLY run in autocommit,
+    outside any transaction, as Postgres requires. A failed concurrent build leaves an
+    INVALID index behind; it is dropped before the build is retried on the next run.
+  * A statement preceded by "-- migrate:backfill batch_size=N sleep_ms=M" is repeated,
+    one committed batch at a time, until it affects no rows. It must use
+    %(batch_size)s to bound each batch, e.g.
+        UPDATE t SET c = 0 WHERE id IN (SELECT id FROM t WHERE c IS NULL LIMIT %(batch_size)s)
+  * Everything else runs in one transaction per run of consecutive statements, with
+    lock_timeout set so DDL waiting behind long queries fails fast instead of
+    blocking writers queued up behind it.
+
+Applied versions are tracked in schema_migrations. Databases migrated by the previous
+external tool can be adopted with --baseline N (marks V0001..VN applied without
+running them).
+'''
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+import psycopg2
+from psycopg2.sql import SQL, Identifier
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'db_migrations')
+FILENAME_RE = re.compile(r'^V(\d+)__(\w+)\.sql$')
+CONCURRENT_RE = re.compile(r'^\s*(CREATE\s+(UNIQUE\s+)?INDEX|DROP\s+INDEX|REINDEX\s+\w+)\s+CONCURRENTLY\b', re.IGNORECASE)
+# Index name, any schema qualifier wrongly put on it, then the table (optionally schema-qualified)
+INDEX_NAME_RE = re.compile(
+    r'^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+    r'("[^"]+"|\w+)(\.(?:"[^"]+"|\w+))?\s+ON\s+(?:ONLY\s+)?((?:"[^"]+"|\w+)(?:\.(?:"[^"]+"|\w+))?)',
+    re.IGNORECASE
+)
+BACKFILL_RE = re.compile(r'^\s*--\s*migrate:backfill\b(.*)$', re.IGNORECASE | re.MULTILINE)
+LOCK_KEY = 727_001
+
+CREATE_HISTORY_SQL = '''
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    description VARCHAR(255) NOT NULL,
+    checksum VARCHAR(64) NOT NULL,
+    execution_ms INTEGER NOT NULL DEFAULT 0,
+    applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+)
+'''
+
+
+@dataclass
+class Step:
+    kind: str
+    sql: str
+    batch_size: int = 0
+    sleep_ms: int = 0
+
+    def label(self) -> str:
+        first_line = ' '.join(self.sql.split())
+        return first_line if len(first_line) <= 80 else first_line[:77] + '...'
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    path: str
+    checksum: str
+    steps: List[Step] = field(default_factory=list)
+
+
+def split_statements(sql: str) -> List[Tuple[str, str]]:
+    '''Splits on top-level semicolons, honouring quotes, comments and $tag$ bodies.
+    Returns (statement, comments preceding it) pairs.'''
+    statements: List[Tuple[str, str]] = []
+    buf: List[str] = []
+    comments: List[str] = []
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch == '-' and sql.startswith('--', i):
+            end = sql.find('\n', i)
+            end = n if end == -1 else end
+            if not ''.join(buf).strip():
+                comments.append(sql[i:end])
+            else:
+                buf.append(sql[i:end])
+            i = end
+        elif ch == '/' and sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            end = n if end == -1 else end + 2
+            buf.append(sql[i:end])
+            i = end
+        elif ch in ("'", '"'):
+            end = i + 1
+            while end < n:
+                if sql[end] == ch:
+                    if end + 1 < n and sql[end + 1] == ch:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            buf.append(sql[i:end + 1])
+            i = end + 1
+        elif ch == '$':
+            tag = re.match(r'\$\w*\$', sql[i:])
+            if tag:
+                end = sql.find(tag.group(0), i + len(tag.group(0)))
+                end = n if end == -1 else end + len(tag.group(0))
+                buf.append(sql[i:end])
+                i = end
+            else:
+                buf.append(ch)
+                i += 1
+        elif ch == ';':
+            statement = ''.join(buf).strip()
+            if statement:
+                statements.append((statement, '\n'.join(comments)))
+            buf, comments = [], []
+            i += 1
+        else:
+            buf.append(ch)
+            i += 1
+    statement = ''.join(buf).strip()
+    if statement:
+        statements.append((statement, '\n'.join(comments)))
+    return statements
+
+
+def parse_options(text: str) -> dict:
+    return {k: int(v) for k, v in re.findall(r'(\w+)=(\d+)', text)}
+
+
+def build_steps(sql: str) -> List[Step]:
+    steps: List[Step] = []
+    for statement, comments in split_statements(sql):
+        backfill = BACKFILL_RE.search(comments)
+        if backfill:
+            options = parse_options(backfill.group(1))
+            steps.append(Step('backfill', statement, options.get('batch_size', 1000), options.get('sleep_ms', 0)))
+        elif CONCURRENT_RE.match(statement):
+            steps.append(Step('concurrent', statement))
+        elif steps and steps[-1].kind == 'transaction':
+            steps[-1].sql += ';\n' + statement
+        else:
+            steps.append(Step('transaction', statement))
+    return steps
+
+
+def load_migrations(directory: str = MIGRATIONS_DIR) -> List[Migration]:
+    migrations = []
+    for name in sorted(os.listdir(directory)):
+        match = FILENAME_RE.match(name)
+        if not match:
+            continue
+        path = os.path.join(directory, name)
+        with open(path, encoding='utf-8') as f:
+            sql = f.read()
+        migrations.append(Migration(
+            version=int(match.group(1)),
+            description=match.group(2).replace('_', ' '),
+            path=path,
+            checksum=hashlib.sha256(sql.encode('utf-8')).hexdigest(),
+            steps=build_steps(sql)
+        ))
+    migrations.sort(key=lambda m: m.version)
+    return migrations
+
+
+def drop_invalid_index(conn, statement: str):
+    '''A concurrent build that failed leaves an INVALID index that IF NOT EXISTS would skip.
+    The index always lives in its table's schema, so it is looked up through the table.'''
+    match = INDEX_NAME_RE.match(statement)
+    if not match:
+        return
+    name, qualified, table = match.groups()
+    if qualified:
+        raise ValueError(f"index name {name}{qualified} must not be schema-qualified; "
+                         f"it is created in the schema of {table}")
+    name = name.strip('"')
+    cur = conn.cursor()
+    cur.execute(
+        '''SELECT n.nspname FROM pg_index i
+           JOIN pg_class c ON c.oid = i.indexrelid
+           JOIN pg_namespace n ON n.oid = c.relnamespace
+           WHERE c.relname = %s AND i.indrelid = to_regclass(%s) AND NOT i.indisvalid''',
+        (name, table)
+    )
+    row = cur.fetchone()
+    if row:
+        print(f"    dropping invalid index {row[0]}.{name} left by an earlier failed build")
+        cur.execute(SQL('DROP INDEX CONCURRENTLY IF EXISTS {}').format(Identifier(row[0], name)))
+    cur.close()
+
+
+def run_step(conn, step: Step, lock_timeout: str) -> str:
+    cur = conn.cursor()
+    if step.kind == 'concurrent':
+        conn.autocommit = True
+        drop_invalid_index(conn, step.sql)
+        cur.execute(step.sql)
+        detail = ''
+    elif step.kind == 'backfill':
+        conn.autocommit = False
+        total, batches = 0, 0
+        while True:
+            cur.execute(step.sql, {'batch_size': step.batch_size})
+            affected = cur.rowcount
+            conn.commit()
+            if affected <= 0:
+                break
+            total += affected
+            batches += 1
+            if step.sleep_ms:
+                time.sleep(step.sleep_ms / 1000)
+        detail = f" ({total} rows in {batches} batches)"
+    else:
+        conn.autocommit = False
+        cur.execute('SET LOCAL lock_timeout = %s', (lock_timeout,))
+        cur.execute(step.sql)
+        conn.commit()
+        detail = ''
+    cur.close()
+    return detail
+
+
+def applied_versions(conn) -> dict:
+    cur = conn.cursor()
+    cur.execute('SELECT version, checksum FROM schema_migrations')
+    rows = dict(cur.fetchall())
+    cur.close()
+    return rows
+
+
+def record(conn, migration: Migration, execution_ms: int):
+    conn.autocommit = False
+    cur = conn.cursor()
+    cur.execute(
+        '''INSERT INTO schema_migrations (version, description, checksum, execution_ms)
+           VALUES (%s, %s, %s, %s) ON CONFLICT (version) DO NOTHING''',
+        (migration.version, migration.description, migration.checksum, execution_ms)
+    )
+    conn.commit()
+    cur.close()
+
+
+def migrate(dsn: str, target: Optional[int] = None, baseline: Optional[int] = None,
+            dry_run: bool = False, lock_timeout: str = '5s') -> int:
+    migrations = load_migrations()
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(CREATE_HISTORY_SQL)
+    cur.execute('SELECT pg_advisory_lock(%s)', (LOCK_KEY,))
+    cur.close()
+
+    try:
+        if baseline is not None:
+            for migration in migrations:
+                if migration.version <= baseline:
+                    record(conn, migration, 0)
+            print(f"Baselined at V{baseline:04d}")
+
+        applied = applied_versions(conn)
+        for migration in migrations:
+            if migration.version in applied and applied[migration.version] != migration.checksum:
+                print(f"warning: V{migration.version:04d} changed after it was applied", file=sys.stderr)
+
+        pending = [
+            m for m in migrations
+            if m.version not in applied and (target is None or m.version <= target)
+        ]
+        if not pending:
+            print('Database is up to date')
+            return 0
+
+        for migration in pending:
+            print(f"V{migration.version:04d} {migration.description}")
+            started = time.perf_counter()
+            for step in migration.steps:
+                if dry_run:
+                    print(f"  [{step.kind}] {step.label()}")
+                    continue
+                step_started = time.perf_counter()
+                detail = run_step(conn, step, lock_timeout)
+                elapsed = (time.perf_counter() - step_started) * 1000
+                print(f"  [{step.kind}] {elapsed:8.1f} ms  {step.label()}{detail}")
+            total_ms = int((time.perf_counter() - started) * 1000)
+            if not dry_run:
+                record(conn, migration, total_ms)
+                print(f"  applied in {total_ms} ms")
+        return 0
+    except (psycopg2.Error, ValueError) as e:
+        print(f"Migration failed: {e}", file=sys.stderr)
+        conn.rollback()
+        return 1
+    finally:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute('SELECT pg_advisory_unlock(%s)', (LOCK_KEY,))
+        cur.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply db_migrations with online-safe index builds')
+    parser.add_argument('--target', type=int, help='apply migrations up to and including this version')
+    parser.add_argument('--baseline', type=int, help='mark V0001..VN as applied without running them')
+    parser.add_argument('--dry-run', action='store_true', help='print the planned steps only')
+    parser.add_argument('--lock-timeout', default='5s', help='lock_timeout for transactional steps')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        print('DATABASE_URL is not set', file=sys.stderr)
+        sys.exit(2)
+    sys.exit(migrate(dsn, args.target, args.baseline, args.dry_run, args.lock_timeout))
+
+
+if __name__ == '__main__':
+    main()
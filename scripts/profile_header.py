@@ -0,0 +1,25 @@
+'''
+Business: Print a signed X-Debug-Profile header value that forces profiling of one request
+Args: PROFILE_DEBUG_SECRET env var (same value as the deployed functions); optional TTL seconds
+Returns: The header value on stdout, e.g. curl -H "X-Debug-Profile: $(python3 scripts/profile_header.py)"
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'auth'))
+
+from profiling import sign_debug_token
+
+
+def main():
+    secret = os.environ.get('PROFILE_DEBUG_SECRET')
+    if not secret:
+        print('PROFILE_DEBUG_SECRET is not set', file=sys.stderr)
+        sys.exit(2)
+    ttl = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    print(sign_debug_token(secret, ttl))
+
+
+if __name__ == '__main__':
+    main()
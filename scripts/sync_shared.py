@@ -0,0 +1,73 @@
+'''
+Business: Keep the shared modules copied into every backend function directory identical
+Args: --write to copy backend/auth's versions over the other copies; without it, only check
+Returns: Exit code 0 when every copy matches backend/auth, 1 otherwise; prints each mismatch
+
+Each function is deployed as a standalone bundle, so framework.py, db.py, activity.py and
+profiling.py live in every function directory that imports them. backend/auth holds the
+copy that is edited; run this after changing it, and in CI with no flags.
+'''
+
+import argparse
+import filecmp
+import os
+import re
+import shutil
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+SOURCE = 'auth'
+SHARED_MODULES = ('framework.py', 'db.py', 'activity.py', 'profiling.py')
+
+
+def function_dirs():
+    return sorted(
+        name for name in os.listdir(BACKEND_DIR)
+        if os.path.isfile(os.path.join(BACKEND_DIR, name, 'index.py'))
+    )
+
+
+def imported_modules(directory: str) -> set:
+    found = set()
+    for name in os.listdir(directory):
+        if not name.endswith('.py'):
+            continue
+        with open(os.path.join(directory, name), encoding='utf-8') as f:
+            found.update(re.findall(r'^(?:from|import)\s+(\w+)', f.read(), re.MULTILINE))
+    return found
+
+
+def sync(write: bool) -> int:
+    problems = 0
+    for function in function_dirs():
+        if function == SOURCE:
+            continue
+        directory = os.path.join(BACKEND_DIR, function)
+        imported = imported_modules(directory)
+        for module in SHARED_MODULES:
+            source = os.path.join(BACKEND_DIR, SOURCE, module)
+            target = os.path.join(directory, module)
+            exists = os.path.exists(target)
+            if not exists and module[:-3] not in imported:
+                continue
+            if exists and filecmp.cmp(source, target, shallow=False):
+                continue
+            if write:
+                shutil.copyfile(source, target)
+                print(f"updated backend/{function}/{module}")
+            else:
+                state = 'differs from' if exists else 'is missing, copy'
+                print(f"backend/{function}/{module} {state} backend/{SOURCE}/{module}")
+                problems += 1
+    return 1 if problems else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check or sync the shared backend modules')
+    parser.add_argument('--write', action='store_true', help=f'copy backend/{SOURCE} versions over the others')
+    args = parser.parse_args()
+    sys.exit(sync(args.write))
+
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,11 @@ export interface FileItem {
   created_at: string;
 }
 
+export interface ExportPage {
+  blob: Blob;
+  nextAfterId: number | null;
+}
+
 export interface UserProfile {
   id: number;
   email: string;
@@ -38,11 +43,48 @@ export interface UserProfile {
   theme: 'light' | 'dark' | 'system';
 }
 
+export interface BootstrapResponse {
+  authenticated: boolean;
+  user: User;
+  profile: UserProfile;
+  userData: { platforms: any[]; games: any[] };
+  files: FileItem[];
+  storage: { fileCount: number; usedBytes: number };
+  unreadMessages: number;
+}
+
+const LAST_WRITE_KEY = 'last_write';
+
+// WAL positions look like 16/B374D848: two hex halves of a 64-bit number
+function writePosition(value: string): number {
+  const [high, low] = value.split('/');
+  return parseInt(high, 16) * 2 ** 32 + parseInt(low, 16);
+}
+
 class ApiClient {
   private token: string | null = null;
+  private lastWrite: string | null = null;
 
   constructor() {
     this.token = localStorage.getItem('auth_token');
+    this.lastWrite = localStorage.getItem(LAST_WRITE_KEY);
+  }
+
+  // Responses to writes carry X-Last-Write; sending the latest one back makes the backend
+  // read from the primary, or a replica that has caught up, instead of returning stale data
+  private async send(url: string, init: RequestInit): Promise<Response> {
+    const headers: Record<string, string> = { ...(init.headers as Record<string, string>) };
+    if (this.lastWrite) headers['X-Last-Write'] = this.lastWrite;
+    const response = await fetch(url, { ...init, headers });
+    this.rememberWrite(response.headers.get('X-Last-Write'));
+    return response;
+  }
+
+  private rememberWrite(position: string | null) {
+    if (!position) return;
+    if (this.lastWrite && writePosition(this.lastWrite) >= writePosition(position)) return;
+    this.lastWrite = position;
+    localStorage.setItem(LAST_WRITE_KEY, position);
   }
 
   setToken(token: string) {
@@ -52,7 +94,9 @@ class ApiClient {
 
   clearToken() {
     this.token = null;
+    this.lastWrite = null;
     localStorage.removeItem('auth_token');
+    localStorage.removeItem(LAST_WRITE_KEY);
   }
 
   getToken() {
@@ -60,7 +104,7 @@ class ApiClient {
   }
 
   async register(email: string, password: string, username: string): Promise<AuthResponse> {
-    const response = await fetch(`${API_BASE.auth}?action=register`, {
+    const response = await this.send(`${API_BASE.auth}?action=register`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -79,7 +123,7 @@ class ApiClient {
   }
 
   async login(email: string, password: string): Promise<AuthResponse> {
-    const response = await fetch(`${API_BASE.auth}?action=login`, {
+    const response = await this.send(`${API_BASE.auth}?action=login`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -100,7 +144,7 @@ class ApiClient {
   async verifyToken(): Promise<{ authenticated: boolean; user?: User }> {
     if (!this.token) return { authenticated: false };
 
-    const response = await fetch(API_BASE.auth, {
+    const response = await this.send(API_BASE.auth, {
       method: 'GET',
       headers: {
         'X-Auth-Token': this.token,
@@ -115,10 +159,33 @@ class ApiClient {
     return response.json();
   }
 
+  async bootstrap(): Promise<BootstrapResponse | null> {
+    if (!this.token) return null;
+
+    const response = await this.send(`${API_BASE.auth}?action=bootstrap`, {
+      method: 'GET',
+      headers: {
+        'X-Auth-Token': this.token,
+      },
+    });
+
+    if (response.status === 401) {
+      this.clearToken();
+      return null;
+    }
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to load dashboard');
+    }
+
+    return response.json();
+  }
+
   async getFiles(): Promise<FileItem[]> {
     if (!this.token) throw new Error('Not authenticated');
 
-    const response = await fetch(API_BASE.files, {
+    const response = await this.send(API_BASE.files, {
       method: 'GET',
       headers: {
         'X-Auth-Token': this.token,
@@ -136,7 +203,7 @@ class ApiClient {
   async getFile(fileId: number): Promise<FileItem> {
     if (!this.token) throw new Error('Not authenticated');
 
-    const response = await fetch(`${API_BASE.files}?id=${fileId}`, {
+    const response = await this.send(`${API_BASE.files}?id=${fileId}`, {
       method: 'GET',
       headers: {
         'X-Auth-Token': this.token,
@@ -151,6 +218,31 @@ class ApiClient {
     return response.json();
   }
 
+  async exportFiles(options: { ids?: number[]; fileType?: string; afterId?: number } = {}): Promise<ExportPage> {
+    if (!this.token) throw new Error('Not authenticated');
+
+    const params = new URLSearchParams({ action: 'export' });
+    params.set('ids', options.ids?.length ? options.ids.join(',') : 'all');
+    if (options.fileType) params.set('file_type', options.fileType);
+    if (options.afterId) params.set('after_id', String(options.afterId));
+
+    const response = await this.send(`${API_BASE.files}?${params}`, {
+      method: 'GET',
+      headers: {
+        'X-Auth-Token': this.token,
+      },
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to export files');
+    }
+
+    // Each call returns one size-capped archive; the header is absent on the last page
+    const next = response.headers.get('X-Next-After-Id');
+    return { blob: await response.blob(), nextAfterId: next ? Number(next) : null };
+  }
+
   async uploadFile(file: File, onProgress?: (percent: number) => void): Promise<FileItem> {
     if (!this.token) throw new Error('Not authenticated');
 
@@ -171,6 +263,12 @@ class ApiClient {
 
     if (onProgress) onProgress(1);
 
+    // Same key on every attempt so a retried upload is stored only once
+    const idempotencyKey = typeof crypto !== 'undefined' && 'randomUUID' in crypto
+      ? crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    const contentHash = await this.hashFile(file);
+
     return new Promise((resolve, reject) => {
       const reader = new FileReader();
       
@@ -188,39 +286,53 @@ class ApiClient {
           
           if (onProgress) onProgress(35);
           
-          const xhr = new XMLHttpRequest();
-          
-          xhr.upload.addEventListener('progress', (e) => {
-            if (e.lengthComputable && onProgress) {
-              const uploadPercent = Math.round(35 + (e.loaded / e.total) * 60);
-              onProgress(uploadPercent);
-            }
-          });
-          
-          xhr.addEventListener('load', async () => {
-            if (xhr.status >= 200 && xhr.status < 300) {
-              if (onProgress) onProgress(100);
-              resolve(JSON.parse(xhr.responseText));
-            } else {
-              const error = JSON.parse(xhr.responseText);
-              reject(new Error(error.error || 'Failed to upload file'));
-            }
-          });
-          
-          xhr.addEventListener('error', () => {
-            reject(new Error('Network error during upload'));
-          });
-          
-          xhr.open('POST', API_BASE.files);
-          xhr.setRequestHeader('Content-Type', 'application/json');
-          xhr.setRequestHeader('X-Auth-Token', this.token!);
-          
-          xhr.send(JSON.stringify({
+          const body = JSON.stringify({
             filename: file.name,
             content: base64,
             file_type: mimeType,
             mime_type: mimeType,
-          }));
+            ...(contentHash ? { content_hash: contentHash } : {}),
+          });
+
+          const send = (attempt: number) => {
+            const xhr = new XMLHttpRequest();
+
+            xhr.upload.addEventListener('progress', (e) => {
+              if (e.lengthComputable && onProgress) {
+                const uploadPercent = Math.round(35 + (e.loaded / e.total) * 60);
+                onProgress(uploadPercent);
+              }
+            });
+
+            xhr.addEventListener('load', async () => {
+              this.rememberWrite(xhr.getResponseHeader('X-Last-Write'));
+              if (xhr.status >= 200 && xhr.status < 300) {
+                if (onProgress) onProgress(100);
+                resolve(JSON.parse(xhr.responseText));
+              } else {
+                const error = JSON.parse(xhr.responseText);
+                reject(new Error(error.error || 'Failed to upload file'));
+              }
+            });
+
+            xhr.addEventListener('error', () => {
+              if (attempt < 2) {
+                send(attempt + 1);
+                return;
+              }
+              reject(new Error('Network error during upload'));
+            });
+
+            xhr.open('POST', API_BASE.files);
+            xhr.setRequestHeader('Content-Type', 'application/json');
+            xhr.setRequestHeader('X-Auth-Token', this.token!);
+            xhr.setRequestHeader('Idempotency-Key', idempotencyKey);
+            if (this.lastWrite) xhr.setRequestHeader('X-Last-Write', this.lastWrite);
+
+            xhr.send(body);
+          };
+
+          send(1);
         } catch (error) {
           reject(error);
         }
@@ -231,10 +343,20 @@ class ApiClient {
     });
   }
 
+  private async hashFile(file: File): Promise<string | null> {
+    if (typeof crypto === 'undefined' || !crypto.subtle) return null;
+    try {
+      const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+      return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+    } catch {
+      return null;
+    }
+  }
+
   async deleteFile(fileId: string): Promise<void> {
     if (!this.token) throw new Error('Not authenticated');
 
-    const response = await fetch(`${API_BASE.files}?file_id=${fileId}`, {
+    const response = await this.send(`${API_BASE.files}?file_id=${fileId}`, {
       method: 'DELETE',
       headers: {
         'X-Auth-Token': this.token,
@@ -250,7 +372,7 @@ class ApiClient {
   async getProfile(): Promise<UserProfile> {
     if (!this.token) throw new Error('Not authenticated');
 
-    const response = await fetch(API_BASE.profile, {
+    const response = await this.send(API_BASE.profile, {
       method: 'GET',
       headers: {
         'X-Session-Token': this.token,
@@ -268,7 +390,7 @@ class ApiClient {
   async updateProfile(updates: Partial<Omit<UserProfile, 'id'>> & { password?: string }): Promise<void> {
     if (!this.token) throw new Error('Not authenticated');
 
-    const response = await fetch(API_BASE.profile, {
+    const response = await this.send(API_BASE.profile, {
       method: 'PUT',
       headers: {
         'Content-Type': 'application/json',
@@ -286,7 +408,7 @@ class ApiClient {
   async deleteAccount(): Promise<void> {
     if (!this.token) throw new Error('Not authenticated');
 
-    const response = await fetch(API_BASE.profile, {
+    const response = await this.send(API_BASE.profile, {
       method: 'DELETE',
       headers: {
         'X-Session-Token': this.token,
@@ -304,7 +426,7 @@ class ApiClient {
   async getUserData(): Promise<{ platforms: any[]; games: any[] }> {
     if (!this.token) throw new Error('Not authenticated');
 
-    const response = await fetch(API_BASE.userData, {
+    const response = await this.send(API_BASE.userData, {
       method: 'GET',
       headers: {
         'X-Auth-Token': this.token,
@@ -322,7 +444,7 @@ class ApiClient {
   async saveUserData(platforms: any[], games: any[]): Promise<void> {
     if (!this.token) throw new Error('Not authenticated');
 
-    const response = await fetch(API_BASE.userData, {
+    const response = await this.send(API_BASE.userData, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -343,7 +465,7 @@ class ApiClient {
     subject: string;
     message: string;
   }): Promise<void> {
-    const response = await fetch(API_BASE.contact, {
+    const response = await this.send(API_BASE.contact, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -360,7 +482,7 @@ class ApiClient {
   async getMessages(): Promise<any[]> {
     if (!this.token) throw new Error('Not authenticated');
 
-    const response = await fetch(API_BASE.contact, {
+    const response = await this.send(API_BASE.contact, {
       method: 'GET',
       headers: {
         'X-Auth-Token': this.token,
@@ -378,7 +500,7 @@ class ApiClient {
   async markMessageAsRead(messageId: number): Promise<void> {
     if (!this.token) throw new Error('Not authenticated');
 
-    const response = await fetch(`${API_BASE.contact}/${messageId}/read`, {
+    const response = await this.send(`${API_BASE.contact}/${messageId}/read`, {
       method: 'PUT',
       headers: {
         'X-Auth-Token': this.token,
@@ -394,7 +516,7 @@ class ApiClient {
   async deleteMessage(messageId: number): Promise<void> {
     if (!this.token) throw new Error('Not authenticated');
 
-    const response = await fetch(`${API_BASE.contact}/${messageId}`, {
+    const response = await this.send(`${API_BASE.contact}/${messageId}`, {
       method: 'DELETE',
       headers: {
         'X-Auth-Token': this.token,
@@ -410,7 +532,7 @@ class ApiClient {
   async replyToMessage(messageId: number, replyText: string): Promise<void> {
     if (!this.token) throw new Error('Not authenticated');
 
-    const response = await fetch(`${API_BASE.contact}/${messageId}/reply`, {
+    const response = await this.send(`${API_BASE.contact}/${messageId}/reply`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
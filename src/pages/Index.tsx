@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Button } from '@/components/ui/button';
 import { Card } from '@/components/ui/card';
 import { Input } from '@/components/ui/input';
@@ -72,6 +72,7 @@ interface Folder {
 
 const Index = () => {
   const [isAuthenticated, setIsAuthenticated] = useState(false);
+  const bootstrappedRef = useRef(false);
   const [currentUser, setCurrentUser] = useState<{ email: string; username: string } | null>(null);
   const [isLoadingAuth, setIsLoadingAuth] = useState(true);
   const [apiFiles, setApiFiles] = useState<ApiFileItem[]>([]);
@@ -92,6 +93,7 @@ const Index = () => {
   const [selectedFileTypes, setSelectedFileTypes] = useState<string[]>(FILE_TYPES.map(t => t.id));
   const [showUploadDialog, setShowUploadDialog] = useState(false);
   const [showFilterPopover, setShowFilterPopover] = useState(false);
+  const [exportingFiles, setExportingFiles] = useState(false);
 
   const [show2FAVerify, setShow2FAVerify] = useState(false);
   const [twoFactorCode, setTwoFactorCode] = useState('');
@@ -283,6 +285,10 @@ const Index = () => {
 
   useEffect(() => {
     if (isAuthenticated) {
+      if (bootstrappedRef.current) {
+        bootstrappedRef.current = false;
+        return;
+      }
       loadFiles();
       loadUserData();
     }
@@ -291,11 +297,16 @@ const Index = () => {
   const checkAuth = async () => {
     try {
       addLog('Проверяю авторизацию...', 'info');
-      const result = await api.verifyToken();
-      if (result.authenticated && result.user) {
-        setIsAuthenticated(true);
+      const result = await api.bootstrap();
+      if (result && result.authenticated) {
+        bootstrappedRef.current = true;
         setCurrentUser({ email: result.user.email, username: result.user.username });
+        setApiFiles(result.files);
+        if (result.userData.platforms.length > 0) setPlatforms(result.userData.platforms);
+        if (result.userData.games.length > 0) setGames(result.userData.games);
+        setIsAuthenticated(true);
         addLog('Авторизация успешна', 'success');
+        addLog(`Загружено файлов: ${result.files.length}`, 'success');
       }
     } catch (error) {
       addLog('Ошибка проверки авторизации', 'error');
@@ -508,6 +519,40 @@ const Index = () => {
     }
   };
 
+  const handleExportFiles = async () => {
+    setExportingFiles(true);
+    try {
+      addLog('Экспортирую файлы в ZIP...', 'info');
+      // The server returns one size-capped archive per call; save each part as it arrives
+      let afterId: number | undefined;
+      let part = 1;
+      do {
+        const page = await api.exportFiles({ afterId });
+        const link = document.createElement('a');
+        link.href = URL.createObjectURL(page.blob);
+        link.download = part === 1 && page.nextAfterId === null ? 'files-export.zip' : `files-export-${part}.zip`;
+        document.body.appendChild(link);
+        link.click();
+        document.body.removeChild(link);
+        URL.revokeObjectURL(link.href);
+        afterId = page.nextAfterId ?? undefined;
+        part++;
+      } while (afterId !== undefined);
+      addLog('Экспорт файлов завершён', 'success');
+      toast({ title: 'Экспорт завершён', description: part > 2 ? `Архивов: ${part - 1}` : 'Архив сохранён' });
+    } catch (error) {
+      addLog('Ошибка экспорта файлов', 'error');
+      console.error('Export error:', error);
+      toast({
+        title: 'Ошибка экспорта',
+        description: error instanceof Error ? error.message : 'Не удалось экспортировать файлы',
+        variant: 'destructive'
+      });
+    } finally {
+      setExportingFiles(false);
+    }
+  };
+
   const handleContextMenu = (e: React.MouseEvent, file: ApiFileItem) => {
     e.preventDefault();
     setContextMenuFile(file);
@@ -860,6 +905,16 @@ const Index = () => {
                   <Icon name="FolderPlus" size={16} />
                 </Button>
 
+                <Button
+                  variant="outline"
+                  size="icon"
+                  onClick={handleExportFiles}
+                  disabled={exportingFiles || apiFiles.length === 0}
+                  title="Скачать все файлы в ZIP"
+                >
+                  <Icon name={exportingFiles ? "Loader2" : "Archive"} size={16} className={exportingFiles ? 'animate-spin' : ''} />
+                </Button>
+
                 <Popover open={showFilterPopover} onOpenChange={setShowFilterPopover}>
                   <PopoverTrigger asChild>
                     <Button variant="outline" size="icon">